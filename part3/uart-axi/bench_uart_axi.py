@@ -0,0 +1,150 @@
+# Throughput and latency benchmark for uart_axi. Launched by test_bench
+# in test_uart_axi.py (pytest --bench); results go to run/bench/*.json,
+# see util/bench.py to compare them across commits.
+#
+# Every case moves payload bytes to or from the RAM in frames of at
+# most burst bytes, either back to back (pipelined) or spaced (each
+# frame waits for the previous one to complete), and records:
+#   bytes_per_s    -- payload bytes per simulated second
+#   efficiency     -- bytes_per_s relative to the UART line rate
+#   latency_cycles -- mean clock cycles from the last request byte on
+#                     the line to the write ack / last response byte
+#                     (spaced cases only)
+#   idle_cycles    -- clock cycles the bridge spent in IDLE
+#   wall_per_sim_ms -- simulator wall-clock seconds per simulated ms
+#
+# A last case streams TRAFFIC_COUNT constrained-random requests
+# (dbg_traffic.py) and records requests_per_s as well.
+
+import os
+import sys
+import time
+import random
+import itertools
+
+# Repository root, found without GitPython (see test_*.py).
+_REPO_ROOT = os.path.dirname(os.path.realpath(__file__))
+while not os.path.exists(os.path.join(_REPO_ROOT, ".git")):
+    assert _REPO_ROOT != os.path.dirname(_REPO_ROOT), "REPO_ROOT path must exist"
+    _REPO_ROOT = os.path.dirname(_REPO_ROOT)
+sys.path.append(os.path.join(_REPO_ROOT, "util"))
+from utilities import clock_start_sequence, reset_sequence
+from dbg_client import CocotbDbgBridge, MEM_BASE, MAX_BLOCK
+from dbg_monitor import DbgBridgeMonitor
+from dbg_traffic import DbgTrafficGenerator, run_traffic
+from bench import BenchResults
+from test_uart_axi import uart_baud
+
+import cocotb
+
+from cocotb.utils import get_sim_time
+from cocotb.triggers import ClockCycles, FallingEdge, with_timeout
+
+from cocotbext.uart import UartSource, UartSink
+
+CLK_PERIOD_PS = 83334 # 12 MHz
+
+PAYLOADS = [64, 1024]
+BURSTS = [4, 16, 64, MAX_BLOCK]
+DIRECTIONS = ["write", "read"]
+MODES = ["back2back", "spaced"]
+TRAFFIC_COUNT = 500
+
+async def run_case(bridge, mon, direction, payload, burst, spaced):
+    """ Run one case and return its metrics.
+
+    Arguments:
+    bridge -- CocotbDbgBridge
+    mon -- DbgBridgeMonitor
+    direction -- "write" or "read"
+    payload -- Total bytes to move
+    burst -- Largest frame, in bytes
+    spaced -- Wait for each frame to complete before the next
+    """
+    frames = [(off, MEM_BASE + off, min(burst, payload - off)) for off in range(0, payload, burst)]
+    data = random.randbytes(payload)
+
+    latencies = []
+    idle_start = mon.idle_time()
+    start = get_sim_time('ps')
+    wall = time.perf_counter()
+
+    acks = None
+    if(direction == "write" and not spaced):
+        acks = mon.write_ack(len(frames), timeout=1000, unit='ms')
+
+    for off, addr, n in frames:
+        if(direction == "write"):
+            ack = mon.write_ack(timeout=100, unit='ms') if spaced else None
+            await bridge.write(addr, data[off:off + n])
+            if(spaced):
+                await bridge.src.wait()
+                sent = get_sim_time('ps')
+                await ack
+                latencies.append(get_sim_time('ps') - sent)
+        else:
+            req = await bridge.read_nowait(addr, n)
+            if(spaced):
+                await bridge.src.wait()
+                sent = get_sim_time('ps')
+                await with_timeout(bridge.result(req), 100, 'ms')
+                latencies.append(get_sim_time('ps') - sent)
+
+    if(acks is not None):
+        await acks
+    await with_timeout(bridge.flush(), 1000, 'ms')
+
+    sim_ps = get_sim_time('ps') - start
+    wall = time.perf_counter() - wall
+    bytes_per_s = payload / (sim_ps * 1e-12)
+    return {"bytes": payload,
+            "frames": len(frames),
+            "sim_ns": sim_ps / 1000,
+            "bytes_per_s": bytes_per_s,
+            "efficiency": bytes_per_s / (uart_baud() / 10),
+            "latency_cycles": sum(latencies) / len(latencies) / CLK_PERIOD_PS if latencies else None,
+            "idle_cycles": (mon.idle_time() - idle_start) / CLK_PERIOD_PS,
+            "wall_s": wall,
+            "wall_per_sim_ms": wall / (sim_ps * 1e-9)}
+
+@cocotb.test()
+async def bench_dbg_bridge(dut):
+    """Sweep payload, burst size, direction and spacing over the bridge."""
+    clk_i = dut.clk_i
+    reset_i = dut.reset_i
+
+    src = UartSource(dut.rx_serial_i, baud=uart_baud(), bits=8, stop_bits=1)
+    snk = UartSink(dut.tx_serial_o, baud=uart_baud(), bits=8, stop_bits=1)
+
+    await clock_start_sequence(clk_i, CLK_PERIOD_PS, 'ps')
+    await reset_sequence(clk_i, reset_i, 10)
+    await FallingEdge(reset_i)
+    await ClockCycles(clk_i, 500)
+
+    random.seed(1)
+    mon = DbgBridgeMonitor(dut)
+    bridge = CocotbDbgBridge(src, snk)
+    results = BenchResults("uart_axi")
+
+    # The results so far are written even if a case fails; util/bench.py
+    # compare lists the cases a run is missing.
+    try:
+        for payload, burst, direction, mode in itertools.product(PAYLOADS, BURSTS, DIRECTIONS, MODES):
+            if(burst > payload):
+                continue
+            case = f"{direction}_{mode}_payload={payload}_burst={burst}"
+            metrics = await run_case(bridge, mon, direction, payload, burst, mode == "spaced")
+            results.add(case, **metrics)
+            dut._log.info(f"{case}: {metrics['bytes_per_s']:.0f} B/s ({metrics['efficiency']:.1%} of line rate), "
+                          f"latency {metrics['latency_cycles'] or 0:.0f} cycles, idle {metrics['idle_cycles']:.0f} cycles, "
+                          f"{metrics['wall_per_sim_ms']:.3f} s/sim-ms")
+
+        stats = await run_traffic(bridge, DbgTrafficGenerator(seed=1), count=TRAFFIC_COUNT)
+        metrics = stats.as_dict()
+        del metrics["kinds"]
+        metrics["efficiency"] = metrics["bytes_per_s"] / (uart_baud() / 10)
+        metrics["wall_per_sim_ms"] = stats.wall_s / (stats.sim_ns * 1e-6)
+        results.add(f"random_traffic_requests={TRAFFIC_COUNT}", **metrics)
+        dut._log.info(f"random traffic: {stats}")
+    finally:
+        dut._log.info(f"Results: {results.write()}")
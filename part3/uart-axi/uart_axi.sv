@@ -1,5 +1,7 @@
 module uart_axi
-  #(parameter example_p = 0)
+  #(parameter example_p = 0
+   // Sim-only override of the UART baud rate; synthesis uses 115200.
+   ,parameter uart_speed_p = 115200)
   (input [0:0] clk_i // 12 MHz clock
   ,input [0:0] reset_i
 
@@ -78,7 +80,7 @@ module uart_axi
 
   dbg_bridge #(
     .CLK_FREQ(12000000),
-    .UART_SPEED(115200),
+    .UART_SPEED(uart_speed_p),
     .AXI_ID(4'd0),
     .GPIO_ADDRESS(32'hf0000000),
     .STS_ADDRESS(32'hf0000004)
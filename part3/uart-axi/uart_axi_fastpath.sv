@@ -0,0 +1,117 @@
+// Sim-only wrapper around uart_axi for the testbench's AXI fast path
+// (see util/dbg_axi.py). Not part of filelist.json, so synthesis and
+// top.sv never see it; test_axi_fast builds it from
+// filelist_fastpath.json.
+//
+// The RAM's inputs are forced from the tb_axi_* signals, which
+// cocotbext.axi's AxiMaster drives, so RAM tests run at AXI speed
+// rather than UART speed. The fast path covers the RAM only: GPIO and
+// STS are registers inside dbg_bridge, not AXI slaves, so they are
+// still reached over the UART. dbg_bridge is cut off from the RAM:
+// accessing_ram is forced low, so its GPIO and STS accesses work as
+// usual and a RAM access over the UART hangs.
+module uart_axi_fastpath
+  #(parameter example_p = 0
+   ,parameter uart_speed_p = 115200)
+  (input [0:0] clk_i // 12 MHz clock
+  ,input [0:0] reset_i
+
+  ,input [0:0] rx_serial_i
+  ,output [0:0] tx_serial_o
+
+  ,input [3:0] buttons_i
+  ,output [5:1] led_o
+   );
+
+  // Driven by the testbench.
+  /* verilator lint_off UNDRIVEN */
+  /* verilator lint_off UNUSEDSIGNAL */
+  reg         tb_axi_awvalid = 1'b0;
+  reg  [31:0] tb_axi_awaddr = 32'h0;
+  reg  [3:0]  tb_axi_awid = 4'h0;
+  reg  [7:0]  tb_axi_awlen = 8'h0;
+  reg  [2:0]  tb_axi_awsize = 3'b010;
+  reg  [1:0]  tb_axi_awburst = 2'b01;
+  wire        tb_axi_awready;
+
+  reg         tb_axi_wvalid = 1'b0;
+  reg  [31:0] tb_axi_wdata = 32'h0;
+  reg  [3:0]  tb_axi_wstrb = 4'h0;
+  reg         tb_axi_wlast = 1'b0;
+  wire        tb_axi_wready;
+
+  wire        tb_axi_bvalid;
+  wire [1:0]  tb_axi_bresp;
+  wire [3:0]  tb_axi_bid;
+  reg         tb_axi_bready = 1'b0;
+
+  reg         tb_axi_arvalid = 1'b0;
+  reg  [31:0] tb_axi_araddr = 32'h0;
+  reg  [3:0]  tb_axi_arid = 4'h0;
+  reg  [7:0]  tb_axi_arlen = 8'h0;
+  reg  [2:0]  tb_axi_arsize = 3'b010;
+  reg  [1:0]  tb_axi_arburst = 2'b01;
+  wire        tb_axi_arready;
+
+  wire        tb_axi_rvalid;
+  wire [31:0] tb_axi_rdata;
+  wire [1:0]  tb_axi_rresp;
+  wire [3:0]  tb_axi_rid;
+  wire        tb_axi_rlast;
+  reg         tb_axi_rready = 1'b0;
+  /* verilator lint_on UNUSEDSIGNAL */
+  /* verilator lint_on UNDRIVEN */
+
+  uart_axi #(
+    .example_p(example_p),
+    .uart_speed_p(uart_speed_p)
+  )
+  u_dut (
+    .clk_i(clk_i),
+    .reset_i(reset_i),
+    .rx_serial_i(rx_serial_i),
+    .tx_serial_o(tx_serial_o),
+    .buttons_i(buttons_i),
+    .led_o(led_o)
+  );
+
+  initial begin
+    force u_dut.accessing_ram = 1'b0;
+
+    force u_dut.u_axi_ram.s_axi_awid = tb_axi_awid;
+    force u_dut.u_axi_ram.s_axi_awaddr = tb_axi_awaddr[11:0];
+    force u_dut.u_axi_ram.s_axi_awlen = tb_axi_awlen;
+    force u_dut.u_axi_ram.s_axi_awsize = tb_axi_awsize;
+    force u_dut.u_axi_ram.s_axi_awburst = tb_axi_awburst;
+    force u_dut.u_axi_ram.s_axi_awvalid = tb_axi_awvalid;
+
+    force u_dut.u_axi_ram.s_axi_wdata = tb_axi_wdata;
+    force u_dut.u_axi_ram.s_axi_wstrb = tb_axi_wstrb;
+    force u_dut.u_axi_ram.s_axi_wlast = tb_axi_wlast;
+    force u_dut.u_axi_ram.s_axi_wvalid = tb_axi_wvalid;
+
+    force u_dut.u_axi_ram.s_axi_bready = tb_axi_bready;
+
+    force u_dut.u_axi_ram.s_axi_arid = tb_axi_arid;
+    force u_dut.u_axi_ram.s_axi_araddr = tb_axi_araddr[11:0];
+    force u_dut.u_axi_ram.s_axi_arlen = tb_axi_arlen;
+    force u_dut.u_axi_ram.s_axi_arsize = tb_axi_arsize;
+    force u_dut.u_axi_ram.s_axi_arburst = tb_axi_arburst;
+    force u_dut.u_axi_ram.s_axi_arvalid = tb_axi_arvalid;
+
+    force u_dut.u_axi_ram.s_axi_rready = tb_axi_rready;
+  end
+
+  assign tb_axi_awready = u_dut.ram_awready;
+  assign tb_axi_wready = u_dut.ram_wready;
+  assign tb_axi_bvalid = u_dut.ram_bvalid;
+  assign tb_axi_bresp = u_dut.ram_bresp;
+  assign tb_axi_bid = u_dut.ram_bid;
+  assign tb_axi_arready = u_dut.ram_arready;
+  assign tb_axi_rvalid = u_dut.ram_rvalid;
+  assign tb_axi_rdata = u_dut.ram_rdata;
+  assign tb_axi_rresp = u_dut.ram_rresp;
+  assign tb_axi_rid = u_dut.ram_rid;
+  assign tb_axi_rlast = u_dut.ram_rlast;
+
+endmodule
@@ -0,0 +1,115 @@
+# Throughput and latency benchmark for uart_axis. Launched by test_bench
+# in test_uart_axis.py (pytest --bench); results go to run/bench/*.json,
+# see util/bench.py to compare them across commits.
+#
+# Every case loops payload bytes back through the UART -> 32-bit AXIS ->
+# UART path in chunks of chunk bytes, either back to back or spaced
+# (each chunk waits for its echo), and records:
+#   bytes_per_s    -- looped-back bytes per simulated second
+#   efficiency     -- bytes_per_s relative to the UART line rate
+#   latency_cycles -- mean clock cycles from the last byte of a chunk
+#                     on the line to the last byte of its echo
+#                     (spaced cases only)
+#   wall_per_sim_ms -- simulator wall-clock seconds per simulated ms
+
+import os
+import sys
+import time
+import random
+import itertools
+
+# Repository root, found without GitPython (see test_*.py).
+_REPO_ROOT = os.path.dirname(os.path.realpath(__file__))
+while not os.path.exists(os.path.join(_REPO_ROOT, ".git")):
+    assert _REPO_ROOT != os.path.dirname(_REPO_ROOT), "REPO_ROOT path must exist"
+    _REPO_ROOT = os.path.dirname(_REPO_ROOT)
+sys.path.append(os.path.join(_REPO_ROOT, "util"))
+from utilities import clock_start_sequence, reset_sequence, wait_uart_bytes
+from bench import BenchResults
+from test_uart_axis import uart_baud
+
+import cocotb
+
+from cocotb.utils import get_sim_time
+from cocotb.triggers import ClockCycles, FallingEdge
+
+from cocotbext.uart import UartSource, UartSink
+
+CLK_PERIOD_NS = 40 # 25 MHz
+
+PAYLOADS = [64, 1024]
+# Multiples of 4: the widener only passes whole words, so a partial
+# chunk would not be echoed until the next one completes it.
+CHUNKS = [4, 16, 64]
+MODES = ["back2back", "spaced"]
+
+async def run_case(usrc, usnk, payload, chunk, spaced):
+    """ Run one case and return its metrics.
+
+    Arguments:
+    usrc -- UartSource on rx_serial_i
+    usnk -- UartSink on tx_serial_o
+    payload -- Total bytes to loop back
+    chunk -- Bytes queued at a time
+    spaced -- Wait for each chunk's echo before sending the next
+    """
+    data = random.randbytes(payload)
+
+    latencies = []
+    received = bytearray()
+    start = get_sim_time('ns')
+    wall = time.perf_counter()
+
+    for off in range(0, payload, chunk):
+        await usrc.write(data[off:off + chunk])
+        if(spaced):
+            await usrc.wait()
+            sent = get_sim_time('ns')
+            received += await wait_uart_bytes(usnk, chunk, 100, 'ms')
+            latencies.append(get_sim_time('ns') - sent)
+
+    if(not spaced):
+        received += await wait_uart_bytes(usnk, payload, 1000, 'ms')
+    assert received == data, "Loopback data mismatch"
+
+    sim_ns = get_sim_time('ns') - start
+    wall = time.perf_counter() - wall
+    bytes_per_s = payload / (sim_ns * 1e-9)
+    return {"bytes": payload,
+            "sim_ns": sim_ns,
+            "bytes_per_s": bytes_per_s,
+            "efficiency": bytes_per_s / (uart_baud() / 10),
+            "latency_cycles": sum(latencies) / len(latencies) / CLK_PERIOD_NS if latencies else None,
+            "wall_s": wall,
+            "wall_per_sim_ms": wall / (sim_ns * 1e-6)}
+
+@cocotb.test()
+async def bench_loopback(dut):
+    """Sweep payload, chunk size and spacing over the loopback."""
+    clk_i = dut.clk_i
+    reset_i = dut.reset_i
+
+    usrc = UartSource(dut.rx_serial_i, baud=uart_baud(), bits=8, stop_bits=1)
+    usnk = UartSink(dut.tx_serial_o, baud=uart_baud(), bits=8, stop_bits=1)
+
+    await clock_start_sequence(clk_i, CLK_PERIOD_NS)
+    await reset_sequence(clk_i, reset_i, 10)
+    await FallingEdge(reset_i)
+    await ClockCycles(clk_i, 10)
+
+    random.seed(1)
+    results = BenchResults("uart_axis")
+
+    # The results so far are written even if a case fails; util/bench.py
+    # compare lists the cases a run is missing.
+    try:
+        for payload, chunk, mode in itertools.product(PAYLOADS, CHUNKS, MODES):
+            if(chunk > payload):
+                continue
+            case = f"loopback_{mode}_payload={payload}_chunk={chunk}"
+            metrics = await run_case(usrc, usnk, payload, chunk, mode == "spaced")
+            results.add(case, **metrics)
+            dut._log.info(f"{case}: {metrics['bytes_per_s']:.0f} B/s ({metrics['efficiency']:.1%} of line rate), "
+                          f"latency {metrics['latency_cycles'] or 0:.0f} cycles, {metrics['wall_per_sim_ms']:.3f} s/sim-ms")
+    finally:
+        dut._log.info(f"Results: {results.write()}")
@@ -1,2 +1,13 @@
+import os
+import sys
+
+# Repository root, found without GitPython (see test_*.py).
+_REPO_ROOT = os.path.dirname(os.path.realpath(__file__))
+while not os.path.exists(os.path.join(_REPO_ROOT, ".git")):
+    assert _REPO_ROOT != os.path.dirname(_REPO_ROOT), "REPO_ROOT path must exist"
+    _REPO_ROOT = os.path.dirname(_REPO_ROOT)
+sys.path.append(os.path.join(_REPO_ROOT, "util"))
+from pytest_options import pytest_addoption, pytest_configure
+
 def pytest_make_parametrize_id(config, val, argname):
     return f"{argname}={val}"
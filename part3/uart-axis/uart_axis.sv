@@ -1,5 +1,8 @@
 module uart_axis
-  #(parameter example_p = 0)
+  #(parameter example_p = 0
+   // Sim-only override of the UART prescale (clk / (baud * 8));
+   // synthesis uses 27, i.e. 115200 baud at 25 MHz.
+   ,parameter prescale_p = 27)
   (input [0:0] clk_i
   ,input [0:0] reset_i
   ,input [0:0] rx_serial_i
@@ -68,7 +71,7 @@ module uart_axis
 
       .rxd(rx_serial_i),
       .txd(tx_serial_o),
-      .prescale(27)
+      .prescale(prescale_p)
    );
 
    axis_adapter #(
@@ -1,14 +1,14 @@
-import serial
+import os
+import sys
 import time
 
-ser = serial.Serial(
-    port='/dev/ttyUSB1',   # adjust to your device
-    baudrate=115200,
-    parity=serial.PARITY_NONE,
-    stopbits=serial.STOPBITS_ONE,
-    bytesize=serial.EIGHTBITS,
-    timeout=1
-)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "util"))
+from fpga_emulator import open_serial
+
+# Pass the port as the first argument, or "emulator:uart_axis" to run
+# against the software model instead of a board.
+port = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyUSB1'   # adjust to your device
+ser = open_serial(port, baud=115200, timeout=1)
 
 # 32-bit FPGA codes - LITTLE ENDIAN (LSB first)
 # axis_adapter accumulates bytes with first byte in LSB
@@ -7,63 +7,53 @@ Tests the UART to AXI bridge functionality:
 - GPIO writes (LEDs)
 - Memory writes and reads
 
+All traffic goes through a ThreadedDbgBridge: a reader thread collects
+responses as they arrive, so nothing waits a fixed time for the board,
+and requests are pipelined. Each test reports the transactions/s it
+achieved.
+
 Usage:
     python test_uart_axi_hardware.py /dev/ttyUSB1
+    python test_uart_axi_hardware.py emulator --batch   # no board needed
 """
 
+import os
 import serial
 import sys
 import time
+import argparse
+import collections
 
-# Protocol constants
-CMD_WRITE = 0x10
-CMD_READ = 0x11
-GPIO_ADDRESS = 0xF0000000
-MEM_BASE = 0x00000000
-
-def create_write_command(addr, data_bytes):
-    """Create a write command packet."""
-    packet = [CMD_WRITE, len(data_bytes)]
-    # Address (big-endian)
-    packet.extend([
-        (addr >> 24) & 0xFF,
-        (addr >> 16) & 0xFF,
-        (addr >> 8) & 0xFF,
-        addr & 0xFF
-    ])
-    packet.extend(data_bytes)
-    return packet
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "util"))
+from dbg_client import ThreadedDbgBridge, word_to_bytes, bytes_to_word, GPIO_ADDRESS, MEM_BASE, MEM_SIZE
+from dbg_codec import encode_words
+from fpga_emulator import open_serial
 
-def create_read_command(addr, num_bytes):
-    """Create a read command packet."""
-    packet = [CMD_READ, num_bytes]
-    # Address (big-endian)
-    packet.extend([
-        (addr >> 24) & 0xFF,
-        (addr >> 16) & 0xFF,
-        (addr >> 8) & 0xFF,
-        addr & 0xFF
-    ])
-    return packet
+def report_rate(bridge, start, requests):
+    """Print the transactions/s achieved since start."""
+    elapsed = time.perf_counter() - start
+    count = bridge.requests - requests
+    print(f"  {count} transactions in {elapsed*1000:.1f} ms ({count/elapsed:.0f} transactions/s)")
 
-def word_to_bytes(word):
-    """Convert 32-bit word to bytes (little-endian)."""
-    return [
-        word & 0xFF,
-        (word >> 8) & 0xFF,
-        (word >> 16) & 0xFF,
-        (word >> 24) & 0xFF
-    ]
+def settle(bridge):
+    """Wait for outstanding responses after an interrupted loop; drop
+    them if they never arrive."""
+    try:
+        bridge.flush()
+    except TimeoutError:
+        bridge.resync()
 
-def bytes_to_word(byte_list):
-    """Convert bytes to 32-bit word (little-endian)."""
-    return (byte_list[0] | 
-            (byte_list[1] << 8) | 
-            (byte_list[2] << 16) | 
-            (byte_list[3] << 24))
+def poll_gpio(bridge, depth=3):
+    """Yield GPIO input values as fast as the link allows, keeping
+    depth reads in flight."""
+    inflight = collections.deque()
+    while True:
+        while len(inflight) < depth:
+            inflight.append(bridge.read_nowait(GPIO_ADDRESS, 4))
+        yield bytes_to_word(bridge.result(inflight.popleft()))
 
-def test_gpio_leds(ser):
-    """Test all LED patterns."""
+def test_gpio_leds(bridge, dwell=0.5):
+    """Test all LED patterns, holding each for dwell seconds."""
     print("\n" + "="*60)
     print("LED TEST - Testing all 5 LEDs")
     print("="*60)
@@ -88,22 +78,14 @@ def test_gpio_leds(ser):
     for pattern, description in led_tests:
         print(f"\nSetting LEDs: 0b{pattern:05b} - {description}")
         print(f"  → Check if physical LEDs match this pattern!")
-        data = word_to_bytes(pattern)
-        cmd = create_write_command(GPIO_ADDRESS, data)
-        
-        ser.write(cmd)
-        ser.flush()  # Ensure data is sent
-        time.sleep(0.5)  # Longer delay to see the pattern
-        
-        # Clear any responses
-        if ser.in_waiting > 0:
-            ser.read(ser.in_waiting)
+        bridge.write(GPIO_ADDRESS, word_to_bytes(pattern))
+        time.sleep(dwell)  # Hold the pattern long enough to see it
     
     print("\n✓ LED test complete - verify LEDs changed on hardware")
     print("  If LEDs didn't change, check your hardware connections")
 
-def test_gpio_buttons(ser):
-    """Test button reading."""
+def test_gpio_buttons(bridge, duration=None):
+    """Test button reading, until Ctrl+C or for duration seconds."""
     print("\n" + "="*60)
     print("BUTTON TEST - Reading button states")
     print("="*60)
@@ -112,55 +94,52 @@ def test_gpio_buttons(ser):
     print("(Press Ctrl+C to stop)")
     print("\nNote: Buttons are active-high, so pressed = 1")
     
-    # Clear any pending data
-    ser.reset_input_buffer()
+    last_buttons = None
+    read_count = 0
+    start = time.perf_counter()
+    last_status = start
     
     try:
-        last_buttons = None
-        read_count = 0
-        
-        while True:
-            read_cmd = create_read_command(GPIO_ADDRESS, 4)
-            ser.write(read_cmd)
-            ser.flush()
-            time.sleep(0.1)  # Wait for response
+        for read_value in poll_gpio(bridge):
+            buttons = read_value & 0x0F
             
-            if ser.in_waiting >= 4:
-                response = list(ser.read(4))
-                read_value = bytes_to_word(response)
-                buttons = read_value & 0x0F
+            # Always show first read and any changes
+            if last_buttons is None or buttons != last_buttons:
+                timestamp = time.strftime("%H:%M:%S")
+                print(f"[{timestamp}] Buttons: 0b{buttons:04b} (0x{buttons:X}) = ", end="")
                 
-                # Always show first read and any changes
-                if last_buttons is None or buttons != last_buttons:
-                    timestamp = time.strftime("%H:%M:%S")
-                    print(f"[{timestamp}] Buttons: 0b{buttons:04b} (0x{buttons:X}) = ", end="")
-                    
-                    if buttons == 0:
-                        print("[No buttons pressed]")
-                    else:
-                        pressed = []
-                        for i in range(4):
-                            if buttons & (1 << i):
-                                pressed.append(f"BTN{i}")
-                        print(f"[{', '.join(pressed)}]")
-                    
-                    last_buttons = buttons
+                if buttons == 0:
+                    print("[No buttons pressed]")
+                else:
+                    pressed = []
+                    for i in range(4):
+                        if buttons & (1 << i):
+                            pressed.append(f"BTN{i}")
+                    print(f"[{', '.join(pressed)}]")
                 
-                read_count += 1
-                if read_count % 20 == 0:
-                    print(f"  ... {read_count} reads completed, still monitoring ...")
-            else:
-                print("⚠ Warning: No response from device")
-            
-            time.sleep(0.2)
+                last_buttons = buttons
             
+            read_count += 1
+            now = time.perf_counter()
+            if now - last_status >= 5:
+                print(f"  ... {read_count} reads completed ({read_count/(now-start):.0f} reads/s), still monitoring ...")
+                last_status = now
+            if duration is not None and now - start >= duration:
+                break
+    
+    except TimeoutError as e:
+        print(f"⚠ Warning: No response from device ({e})")
     except KeyboardInterrupt:
-        print(f"\n✓ Button test complete ({read_count} reads total)")
-        if last_buttons == 0:
-            print("⚠ Note: No button presses detected.")
-            print("  Check: 1) Are buttons connected? 2) Button polarity correct?")
+        pass
+    
+    settle(bridge)
+    elapsed = time.perf_counter() - start
+    print(f"\n✓ Button test complete ({read_count} reads total, {read_count/elapsed:.0f} reads/s)")
+    if last_buttons == 0:
+        print("⚠ Note: No button presses detected.")
+        print("  Check: 1) Are buttons connected? 2) Button polarity correct?")
 
-def test_memory(ser):
+def test_memory(bridge):
     """Test memory read/write functionality."""
     print("\n" + "="*60)
     print("MEMORY TEST - Testing 4KB memory")
@@ -175,67 +154,82 @@ def test_memory(ser):
     ]
     
     all_passed = True
+    start, requests = time.perf_counter(), bridge.requests
     
+    # Issue every write and read-back back to back, then check them
+    reads = []
     for addr, test_data, description in test_cases:
+        bridge.write(addr, word_to_bytes(test_data))
+        reads.append(bridge.read_nowait(addr, 4))
+    
+    for (addr, test_data, description), req in zip(test_cases, reads):
         print(f"\nTesting {description} (0x{addr:08X}):")
         print(f"  Writing: 0x{test_data:08X}")
         
-        # Write
-        write_data = word_to_bytes(test_data)
-        write_cmd = create_write_command(addr, write_data)
-        ser.write(write_cmd)
-        time.sleep(0.1)
-        
-        # Read back
-        read_cmd = create_read_command(addr, 4)
-        ser.write(read_cmd)
-        time.sleep(0.1)
+        try:
+            read_value = bytes_to_word(bridge.result(req))
+        except TimeoutError:
+            print(f"  ✗ FAIL - No response")
+            settle(bridge)
+            return False
+        print(f"  Read:    0x{read_value:08X}")
         
-        if ser.in_waiting >= 4:
-            response = list(ser.read(4))
-            read_value = bytes_to_word(response)
-            print(f"  Read:    0x{read_value:08X}")
-            
-            if read_value == test_data:
-                print(f"  ✓ PASS")
-            else:
-                print(f"  ✗ FAIL - Data mismatch!")
-                all_passed = False
+        if read_value == test_data:
+            print(f"  ✓ PASS")
         else:
-            print(f"  ✗ FAIL - No response")
+            print(f"  ✗ FAIL - Data mismatch!")
             all_passed = False
+    report_rate(bridge, start, requests)
     
-    # Pattern test - write and verify multiple locations
+    # Pattern test - write and verify multiple locations with one
+    # block write and one block read (a single frame each).
     print("\nPattern test - writing sequential data...")
-    for i in range(0, 64, 4):
-        addr = MEM_BASE + i
-        data = 0x10000000 + i
-        write_cmd = create_write_command(addr, word_to_bytes(data))
-        ser.write(write_cmd)
-        time.sleep(0.02)
+    pattern = encode_words(range(0x10000000, 0x10000040, 4))
+    bridge.write_block(MEM_BASE, pattern)
     
     print("Verifying pattern...")
     mismatches = 0
+    try:
+        readback = bridge.read_block(MEM_BASE, len(pattern))
+    except TimeoutError as e:
+        print(f"  ✗ FAIL - {e}")
+        settle(bridge)
+        return False
+    
     for i in range(0, 64, 4):
         addr = MEM_BASE + i
         expected = 0x10000000 + i
-        read_cmd = create_read_command(addr, 4)
-        ser.write(read_cmd)
-        time.sleep(0.05)
-        
-        if ser.in_waiting >= 4:
-            response = list(ser.read(4))
-            read_value = bytes_to_word(response)
-            if read_value != expected:
-                print(f"  ✗ Mismatch at 0x{addr:08X}: expected 0x{expected:08X}, got 0x{read_value:08X}")
-                mismatches += 1
-                all_passed = False
+        read_value = bytes_to_word(readback[i:i+4])
+        if read_value != expected:
+            print(f"  ✗ Mismatch at 0x{addr:08X}: expected 0x{expected:08X}, got 0x{read_value:08X}")
+            mismatches += 1
+            all_passed = False
     
     if mismatches == 0:
         print(f"  ✓ All 16 locations verified correctly")
     else:
         print(f"  ✗ {mismatches} locations had mismatches")
     
+    # Full memory load and dump
+    print("\nFull 4KB load and dump...")
+    image = os.urandom(MEM_SIZE)
+    start, requests = time.perf_counter(), bridge.requests
+    bridge.write_block(MEM_BASE, image)
+    try:
+        dump = bridge.read_block(MEM_BASE, MEM_SIZE)
+    except TimeoutError as e:
+        print(f"  ✗ FAIL - {e}")
+        settle(bridge)
+        return False
+    elapsed = time.perf_counter() - start
+    
+    if dump == image:
+        print(f"  ✓ 4KB verified ({2*MEM_SIZE/elapsed:.0f} bytes/s)")
+    else:
+        print(f"  ✗ FAIL - 4KB dump does not match")
+        all_passed = False
+    report_rate(bridge, start, requests)
+    
     if all_passed:
         print("\n✓ All memory tests PASSED")
     else:
@@ -243,7 +237,7 @@ def test_memory(ser):
     
     return all_passed
 
-def interactive_mode(ser):
+def interactive_mode(bridge):
     """Interactive mode for manual testing."""
     print("\n" + "="*60)
     print("INTERACTIVE MODE")
@@ -274,79 +268,58 @@ def interactive_mode(ser):
                 
                 pattern &= 0x1F
                 print(f"Setting LEDs to 0b{pattern:05b}")
-                write_cmd = create_write_command(GPIO_ADDRESS, word_to_bytes(pattern))
-                ser.write(write_cmd)
-                ser.flush()
-                time.sleep(0.1)
+                bridge.write(GPIO_ADDRESS, word_to_bytes(pattern))
             
             elif cmd == "buttons" or cmd == "read buttons":
-                ser.reset_input_buffer()
-                read_cmd = create_read_command(GPIO_ADDRESS, 4)
-                ser.write(read_cmd)
-                ser.flush()
-                time.sleep(0.15)
-                
-                if ser.in_waiting >= 4:
-                    response = list(ser.read(4))
-                    value = bytes_to_word(response)
-                    buttons = value & 0x0F
-                    print(f"GPIO value: 0x{value:08X}")
-                    print(f"  Buttons: 0b{buttons:04b} (", end="")
-                    if buttons == 0:
-                        print("none pressed)")
-                    else:
-                        pressed = [f"BTN{i}" for i in range(4) if buttons & (1<<i)]
-                        print(f"{', '.join(pressed)} pressed)")
+                try:
+                    value = bytes_to_word(bridge.read(GPIO_ADDRESS, 4))
+                except TimeoutError:
+                    print(f"⚠ No response")
+                    settle(bridge)
+                    continue
+                buttons = value & 0x0F
+                print(f"GPIO value: 0x{value:08X}")
+                print(f"  Buttons: 0b{buttons:04b} (", end="")
+                if buttons == 0:
+                    print("none pressed)")
                 else:
-                    print(f"⚠ No response (bytes available: {ser.in_waiting})")
+                    pressed = [f"BTN{i}" for i in range(4) if buttons & (1<<i)]
+                    print(f"{', '.join(pressed)} pressed)")
             
             elif cmd == "monitor":
                 print("Monitoring buttons... (Ctrl+C to stop)")
+                count = 0
+                start = time.perf_counter()
                 try:
                     last = None
-                    while True:
-                        ser.reset_input_buffer()
-                        read_cmd = create_read_command(GPIO_ADDRESS, 4)
-                        ser.write(read_cmd)
-                        ser.flush()
-                        time.sleep(0.15)
-                        
-                        if ser.in_waiting >= 4:
-                            response = list(ser.read(4))
-                            value = bytes_to_word(response)
-                            buttons = value & 0x0F
-                            if buttons != last:
-                                print(f"0b{buttons:04b}", end=" ", flush=True)
-                                last = buttons
-                        time.sleep(0.1)
-                except KeyboardInterrupt:
-                    print("\nMonitoring stopped")
+                    for value in poll_gpio(bridge):
+                        buttons = value & 0x0F
+                        if buttons != last:
+                            print(f"0b{buttons:04b}", end=" ", flush=True)
+                            last = buttons
+                        count += 1
+                except (KeyboardInterrupt, TimeoutError):
+                    settle(bridge)
+                    print(f"\nMonitoring stopped ({count/(time.perf_counter()-start):.0f} reads/s)")
             
             elif cmd == "sweep":
                 print("LED sweep animation...")
                 for _ in range(3):
                     for i in range(5):
-                        pattern = 1 << i
-                        ser.write(create_write_command(GPIO_ADDRESS, word_to_bytes(pattern)))
-                        ser.flush()
+                        bridge.write(GPIO_ADDRESS, word_to_bytes(1 << i))
                         time.sleep(0.1)
                     for i in range(3, -1, -1):
-                        pattern = 1 << i
-                        ser.write(create_write_command(GPIO_ADDRESS, word_to_bytes(pattern)))
-                        ser.flush()
+                        bridge.write(GPIO_ADDRESS, word_to_bytes(1 << i))
                         time.sleep(0.1)
-                ser.write(create_write_command(GPIO_ADDRESS, word_to_bytes(0)))
-                ser.flush()
+                bridge.write(GPIO_ADDRESS, word_to_bytes(0))
                 print("Done")
             
             elif cmd == "blink":
                 print("Blinking LEDs...")
                 for _ in range(5):
-                    ser.write(create_write_command(GPIO_ADDRESS, word_to_bytes(0x1F)))
-                    ser.flush()
+                    bridge.write(GPIO_ADDRESS, word_to_bytes(0x1F))
                     time.sleep(0.2)
-                    ser.write(create_write_command(GPIO_ADDRESS, word_to_bytes(0x00)))
-                    ser.flush()
+                    bridge.write(GPIO_ADDRESS, word_to_bytes(0x00))
                     time.sleep(0.2)
                 print("Done")
             
@@ -356,10 +329,7 @@ def interactive_mode(ser):
                     addr = int(parts[1], 16)
                     data = int(parts[2], 16)
                     print(f"Writing 0x{data:08X} to 0x{addr:08X}")
-                    write_cmd = create_write_command(addr, word_to_bytes(data))
-                    ser.write(write_cmd)
-                    ser.flush()
-                    time.sleep(0.1)
+                    bridge.write(addr, word_to_bytes(data))
                 else:
                     print("Usage: write <addr> <data>")
             
@@ -367,18 +337,12 @@ def interactive_mode(ser):
                 parts = cmd.split()
                 if len(parts) == 2:
                     addr = int(parts[1], 16)
-                    ser.reset_input_buffer()
-                    read_cmd = create_read_command(addr, 4)
-                    ser.write(read_cmd)
-                    ser.flush()
-                    time.sleep(0.15)
-                    
-                    if ser.in_waiting >= 4:
-                        response = list(ser.read(4))
-                        value = bytes_to_word(response)
+                    try:
+                        value = bytes_to_word(bridge.read(addr, 4))
                         print(f"Read from 0x{addr:08X}: 0x{value:08X}")
-                    else:
-                        print(f"⚠ No response (bytes available: {ser.in_waiting})")
+                    except TimeoutError:
+                        print(f"⚠ No response")
+                        settle(bridge)
                 else:
                     print("Usage: read <addr>")
             
@@ -392,12 +356,13 @@ def interactive_mode(ser):
             print(f"Error: {e}")
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python test_uart_axi_hardware.py <serial_port>")
-        print("Example: python test_uart_axi_hardware.py /dev/ttyUSB1")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="UART-AXI Hardware Test")
+    parser.add_argument("port", help="Serial port, e.g. /dev/ttyUSB1, or 'emulator' for the software model")
+    parser.add_argument("--batch", action="store_true",
+                        help="Run the LED, memory and a short button test without waiting for the user, then exit")
+    args = parser.parse_args()
     
-    port = sys.argv[1]
+    port = args.port
     
     print("="*60)
     print("UART-AXI Hardware Test")
@@ -406,22 +371,14 @@ def main():
     print(f"Baud: 115200")
     
     try:
-        ser = serial.Serial(
-            port=port,
-            baudrate=115200,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            bytesize=serial.EIGHTBITS,
-            timeout=1
-        )
+        ser = open_serial(port, baud=115200, timeout=1)
         
         print("✓ Serial port opened")
-        time.sleep(0.5)
         
         # Clear any pending data
         ser.reset_input_buffer()
         ser.reset_output_buffer()
-        time.sleep(0.1)
+        bridge = ThreadedDbgBridge(ser)
         
         print("\n" + "="*60)
         print("TESTING BASIC COMMUNICATION")
@@ -429,29 +386,30 @@ def main():
         
         # Quick test - read memory address 0
         print("\nQuick test: Reading memory at 0x00000000...")
-        read_cmd = create_read_command(0x00000000, 4)
-        ser.write(read_cmd)
-        ser.flush()
-        time.sleep(0.2)
-        
-        if ser.in_waiting >= 4:
-            response = list(ser.read(4))
-            value = bytes_to_word(response)
+        try:
+            value = bytes_to_word(bridge.read(0x00000000, 4))
             print(f"✓ Communication working! Read: 0x{value:08X}")
-        else:
+        except TimeoutError:
             print("✗ No response - check connections and baud rate")
-            print(f"  Bytes available: {ser.in_waiting}")
-            return
+            print(f"  Bytes received: {bridge.stray_bytes}")
+            sys.exit(1)
         
         # Run tests
-        test_gpio_leds(ser)
-        test_memory(ser)
-        test_gpio_buttons(ser)
-        interactive_mode(ser)
+        if args.batch:
+            test_gpio_leds(bridge, dwell=0)
+            passed = test_memory(bridge)
+            test_gpio_buttons(bridge, duration=1)
+        else:
+            test_gpio_leds(bridge)
+            passed = test_memory(bridge)
+            test_gpio_buttons(bridge)
+            interactive_mode(bridge)
         
+        bridge.close()
         ser.close()
         print("\n✓ All tests complete!")
-        
+        sys.exit(0 if passed else 1)
+    
     except serial.SerialException as e:
         print(f"✗ Serial port error: {e}")
         sys.exit(1)
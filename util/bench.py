@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark results for the bench_*.py cocotb modules.
+
+Each module's test_bench (run with pytest --bench, or SIM_BENCH=1)
+launches its benchmark through utilities.runner. The benchmark records
+one entry per case (throughput, latency, idle cycles, simulator wall
+time) and writes them, with the commit and parameters, to a JSON file
+under run/bench (or $SIM_BENCH_DIR). Files from two commits can then be
+compared:
+
+Usage:
+    python3 util/bench.py compare OLD NEW [--tolerance FRAC] [--wall-tolerance FRAC]
+
+OLD and NEW are JSON files or directories of them. Exits 1 if any
+metric got worse by more than the tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+# Metrics compared by compare(), and which direction is better.
+# Simulated metrics are deterministic; wall-clock ones are noisy and get
+# their own tolerance.
+HIGHER_IS_BETTER = ["bytes_per_s", "efficiency", "requests_per_s"]
+LOWER_IS_BETTER = ["latency_cycles", "idle_cycles"]
+WALL_METRICS = ["wall_per_sim_ms"]
+
+def bench_enabled():
+    """ True if benchmarks were requested (--bench or SIM_BENCH). """
+    return os.environ.get("SIM_BENCH", "").lower() in ("1", "true", "yes")
+
+def bench_env(tbpath, name, simulator, params):
+    """ Tell the benchmark about to be launched where to write its
+    results and what it is running. Returns the results path.
+
+    Arguments:
+    tbpath -- Module directory
+    name -- Benchmark name
+    simulator -- Simulator name
+    params -- Parameter dict passed to runner
+    """
+    outdir = os.environ.get("SIM_BENCH_DIR") or os.path.join(tbpath, "run", "bench")
+    os.makedirs(outdir, exist_ok=True)
+    key = "_".join([name, simulator] + [f"{k}={v}" for k, v in sorted(params.items())])
+    path = os.path.abspath(os.path.join(outdir, key + ".json"))
+
+    os.environ["SIM_BENCH_FILE"] = path
+    os.environ["SIM_BENCH_META"] = json.dumps({"simulator": simulator, "params": params})
+    return path
+
+def git_commit(path=None):
+    """ Get the commit of the repository containing path, with a
+    "-dirty" suffix for uncommitted changes, or None outside git. """
+    cwd = path or os.path.dirname(os.path.realpath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+class BenchResults:
+    """Cases of one benchmark run. The simulator and parameters come
+    from bench_env() through the environment.
+
+    name -- Benchmark name
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.meta = json.loads(os.environ.get("SIM_BENCH_META", "{}"))
+        self.cases = []
+
+    def add(self, case, **metrics):
+        """ Record one case.
+
+        Arguments:
+        case -- Unique case name within the benchmark
+        metrics -- Metric name -> value
+        """
+        self.cases.append(dict(case=case, **metrics))
+
+    def write(self, path=None):
+        """ Write the results as JSON to path (default $SIM_BENCH_FILE,
+        else <name>.json in the current directory). Returns the path. """
+        path = path or os.environ.get("SIM_BENCH_FILE") or os.path.abspath(self.name + ".json")
+        result = {"bench": self.name,
+                  "commit": git_commit(),
+                  "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "host": platform.node(),
+                  "meta": self.meta,
+                  "cases": self.cases}
+        with open(path, "w") as fd:
+            json.dump(result, fd, indent=1)
+        return path
+
+def load(path):
+    """ Load benchmark results from a file or a directory of files,
+    keyed on (bench, simulator, params, case). """
+    files = [path]
+    if(os.path.isdir(path)):
+        files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".json"))
+
+    cases = {}
+    for f in files:
+        with open(f) as fd:
+            result = json.load(fd)
+        meta = result.get("meta", {})
+        params = json.dumps(meta.get("params", {}), sort_keys=True)
+        for c in result["cases"]:
+            cases[(result["bench"], meta.get("simulator"), params, c["case"])] = c
+    return cases
+
+def compare(old, new, tolerance=0.02, wall_tolerance=0.25):
+    """ Compare two sets of results from load(). Prints every metric
+    that changed and returns the regressions.
+
+    Arguments:
+    old -- Baseline results
+    new -- Results to check
+    tolerance -- Allowed relative change of simulated metrics
+    wall_tolerance -- Allowed relative change of wall-clock metrics
+    """
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER + WALL_METRICS:
+            a, b = old[key].get(metric), new[key].get(metric)
+            if(a is None or b is None or a == b):
+                continue
+
+            change = (b - a) / a if a else float("inf")
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            limit = wall_tolerance if metric in WALL_METRICS else tolerance
+            status = "REGRESSION" if worse > limit else "ok"
+            if(worse > limit):
+                regressions.append((key, metric, a, b))
+            print(f"{status:10} {key[0]} {key[1]} {key[2]} {key[3]}: {metric} {a:.4g} -> {b:.4g} ({change:+.1%})")
+
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{'only old' if key in old else 'only new':10} {' '.join(str(k) for k in key)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results across commits.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmp = sub.add_parser("compare", help="Compare two result files or directories")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    cmp.add_argument("--tolerance", type=float, default=0.02, help="Allowed relative change of simulated metrics (default: 0.02)")
+    cmp.add_argument("--wall-tolerance", type=float, default=0.25, help="Allowed relative change of wall-clock metrics (default: 0.25)")
+    args = parser.parse_args()
+
+    regressions = compare(load(args.old), load(args.new), args.tolerance, args.wall_tolerance)
+    print(f"{len(regressions)} regressions")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
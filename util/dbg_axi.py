@@ -0,0 +1,142 @@
+# Transaction-level fast path for the RAM in uart_axi. The sim-only
+# wrapper part3/uart-axi/uart_axi_fastpath.sv forces the RAM's inputs
+# from its tb_axi_* signals, and AxiDbgBridge reads and writes the RAM
+# through them with cocotbext.axi's AxiMaster: a 4 KB load takes a few
+# thousand clocks instead of tens of thousands of UART bit times. The
+# RTL is unchanged.
+#
+# AxiDbgBridge has the RAM half of CocotbDbgBridge's API, so a bulk RAM
+# test can run on either (see ram_client in test_uart_axi.py). GPIO and
+# STS are registers inside dbg_bridge, not on the AXI bus, so they stay
+# UART-only; keep a few end-to-end tests on the UART path for those
+# and for the bridge itself.
+
+import collections
+
+from dbg_codec import as_bytes, decode_words, encode_word
+from dbg_client import MEM_BASE, MEM_SIZE
+
+# Signal prefix of the fast path port in uart_axi_fastpath.sv
+PREFIX = "tb_axi"
+
+def axi_bypass(dut):
+    """ True if dut is the fast path wrapper (uart_axi_fastpath) rather
+    than uart_axi itself. """
+    return hasattr(dut, PREFIX + "_awvalid")
+
+def uart_axi(dut):
+    """ Get the uart_axi handle: dut itself, or the instance inside the
+    fast path wrapper. """
+    return dut.u_dut if axi_bypass(dut) else dut
+
+class AxiDbgRequest:
+    """One transaction in flight. data holds the read data once it has
+    completed (None for writes)."""
+
+    def __init__(self, event, length):
+        self.event = event
+        self.length = length
+        self.data = None
+        self.checked = False
+
+    @property
+    def done(self):
+        return self.event.is_set()
+
+class AxiDbgBridge:
+    """RAM client on the AXI fast path of uart_axi. RAM only: GPIO and
+    STS are not on the AXI bus, and addresses outside the RAM fail.
+
+    Requests are issued without waiting for earlier ones, like the
+    pipelined UART client; AxiMaster splits them into bursts. AXI does
+    not order reads against writes, so a read first waits for the
+    writes before it and a write for the reads before it, which keeps
+    the UART client's in-order results. Every response must be OKAY.
+
+    dut -- uart_axi_fastpath
+    """
+
+    def __init__(self, dut):
+        # Only imported here so that the other dbg_* helpers load
+        # without cocotbext.axi.
+        from cocotbext.axi import AxiBus, AxiMaster, AxiResp
+
+        assert axi_bypass(dut), "The AXI fast path needs the uart_axi_fastpath wrapper (filelist_fastpath.json)"
+        self.axi = AxiMaster(AxiBus.from_prefix(dut, PREFIX), dut.clk_i, dut.reset_i)
+        self._okay = AxiResp.OKAY
+        self.pending = collections.deque()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _check_range(self, addr, length):
+        assert MEM_BASE <= addr and addr + length <= MEM_BASE + MEM_SIZE, \
+            f"0x{addr:08x}+{length} is outside the RAM; GPIO and STS are only reachable over the UART"
+
+    async def _wait_for(self, reads):
+        for req in list(self.pending):
+            if(bool(req.length) == reads):
+                await self.result(req)
+        while self.pending and self.pending[0].checked:
+            self.pending.popleft()
+
+    def _complete(self, req):
+        resp = req.event.data
+        assert resp.resp == self._okay, f"AXI error response {resp.resp}"
+        req.checked = True
+        if(req.length):
+            req.data = bytes(resp.data)
+            self.bytes_received += req.length
+
+    async def write(self, addr, data):
+        """Start a write. Returns the request."""
+        data = as_bytes(data)
+        self._check_range(addr, len(data))
+        await self._wait_for(reads=True)
+        req = AxiDbgRequest(self.axi.init_write(addr - MEM_BASE, data), 0)
+        self.pending.append(req)
+        self.requests += 1
+        self.bytes_sent += len(data)
+        return req
+
+    async def read_nowait(self, addr, num_bytes):
+        """Start a read. Returns the request; await result(req) for its
+        data."""
+        self._check_range(addr, num_bytes)
+        await self._wait_for(reads=False)
+        req = AxiDbgRequest(self.axi.init_read(addr - MEM_BASE, num_bytes), num_bytes)
+        self.pending.append(req)
+        self.requests += 1
+        return req
+
+    async def result(self, req):
+        """Wait for and return the response data of a read request."""
+        if(not req.checked):
+            await req.event.wait()
+            self._complete(req)
+        return req.data
+
+    async def read(self, addr, num_bytes):
+        return await self.result(await self.read_nowait(addr, num_bytes))
+
+    async def flush(self):
+        """Wait for every transaction issued so far."""
+        while self.pending:
+            await self.result(self.pending.popleft())
+
+    async def write_block(self, addr, data):
+        """Write a buffer of any length starting at addr."""
+        await self.write(addr, data)
+
+    async def read_block(self, addr, length):
+        """Read length bytes starting at addr. Returns a bytearray."""
+        return bytearray(await self.read(addr, length))
+
+    async def write_words(self, addrs, words):
+        """Write one word to each of addrs."""
+        for a, w in zip(addrs, words):
+            await self.write(a, encode_word(w))
+
+    async def read_words(self, addr, count):
+        """Read count consecutive words starting at addr."""
+        return decode_words(await self.read_block(addr, 4 * count))
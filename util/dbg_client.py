@@ -0,0 +1,393 @@
+# Client for the UART -> AXI debug bridge (part3/uart-axi/dbg_bridge.v),
+# shared by the cocotb testbench and the hardware scripts.
+#
+# Requests (address is big-endian, data is sent in bus byte order):
+#   write: 0x10, len, addr[31:24], addr[23:16], addr[15:8], addr[7:0], data[0] ... data[len-1]
+#   read:  0x11, len, addr[31:24], addr[23:16], addr[15:8], addr[7:0]
+#
+# A read is answered with exactly len bytes and nothing else is ever
+# sent back, so responses are matched to reads in order.
+
+import threading
+import collections
+
+from dbg_codec import MAX_LENGTH, as_bytes, encode_write, encode_read, \
+    encode_word, decode_word, encode_word_writes, decode_words
+
+GPIO_ADDRESS = 0xF0000000
+STS_ADDRESS = 0xF0000004
+MEM_BASE = 0x00000000
+MEM_SIZE = 0x1000
+
+# Largest frame used by the block transfers. dbg_bridge never issues
+# AXI bursts (awlen/arlen are 0), it walks the frame one word at a
+# time, so the only limit is the length field; keeping frames a
+# multiple of 4 keeps every frame after the first word-aligned.
+MAX_BLOCK = MAX_LENGTH & ~3
+
+# The packet helpers the tests have always used, now thin wrappers
+# around dbg_codec. They return bytes rather than lists of ints.
+def create_write_command(addr, data_bytes):
+    """Create a write command packet."""
+    return encode_write(addr, data_bytes)
+
+def create_read_command(addr, num_bytes):
+    """Create a read command packet."""
+    return encode_read(addr, num_bytes)
+
+def word_to_bytes(word):
+    """Convert 32-bit word to bytes (little-endian)."""
+    return encode_word(word)
+
+def bytes_to_word(byte_list):
+    """Convert bytes to 32-bit word (little-endian)."""
+    return decode_word(byte_list)
+
+class DbgBridgeRequest:
+    """One request. frame holds the encoded frame(s), count how many
+    frames that is, length the number of response bytes (0 for
+    writes); data holds the response once it has arrived."""
+
+    def __init__(self, frame, length, count=1):
+        self.frame = frame
+        self.length = length
+        self.count = count
+        self.data = None
+
+    @property
+    def done(self):
+        return self.length == 0 or self.data is not None
+
+class DbgBridgeClient:
+    """Transport independent part of the pipelined client.
+
+    Requests are sent back to back without waiting for earlier
+    responses. The bridge's UART FIFOs are only 8 bytes deep, and the
+    bridge stops draining its RX FIFO while its TX FIFO is full, so a
+    new request is only sent while at most fifo_depth response bytes
+    are outstanding. Subclasses implement the transport.
+    """
+
+    # Depth of the RX and TX FIFOs in dbg_bridge.v
+    FIFO_DEPTH = 8
+
+    def __init__(self, fifo_depth=FIFO_DEPTH):
+        self.fifo_depth = fifo_depth
+        self.pending = collections.deque()
+        self.outstanding = 0
+
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _can_send(self):
+        return self.outstanding <= self.fifo_depth
+
+    def _sent(self, req):
+        self.requests += req.count
+        self.bytes_sent += len(req.frame)
+        if req.length:
+            self.pending.append(req)
+            self.outstanding += req.length
+
+    def _received(self, data):
+        req = self.pending.popleft()
+        req.data = bytes(data)
+        self.outstanding -= req.length
+        self.bytes_received += req.length
+        return req
+
+    @staticmethod
+    def write_request(addr, data):
+        return DbgBridgeRequest(encode_write(addr, data), 0)
+
+    @staticmethod
+    def read_request(addr, num_bytes):
+        return DbgBridgeRequest(encode_read(addr, num_bytes), num_bytes)
+
+    @staticmethod
+    def word_writes_request(addrs, words):
+        """Single-word writes to scattered addresses, encoded in one go."""
+        return DbgBridgeRequest(encode_word_writes(addrs, words), 0, len(addrs))
+
+    @staticmethod
+    def blocks(addr, length):
+        """ Split a transfer into frames of at most MAX_BLOCK bytes that
+        end on word boundaries. Yields (offset, address, length).
+
+        Arguments:
+        addr -- Start address
+        length -- Transfer length in bytes
+        """
+        offset = 0
+        while offset < length:
+            n = min(length - offset, MAX_BLOCK - ((addr + offset) & 3))
+            yield offset, addr + offset, n
+            offset += n
+
+    @staticmethod
+    def assemble(reqs, length):
+        """Concatenate the responses of a block read."""
+        data = bytearray(length)
+        for offset, req in reqs:
+            data[offset:offset + req.length] = req.data
+        return data
+
+class SerialDbgBridge(DbgBridgeClient):
+    """Blocking client on a pyserial port (or anything with write/read
+    and a read timeout)."""
+
+    def __init__(self, ser, fifo_depth=DbgBridgeClient.FIFO_DEPTH):
+        super().__init__(fifo_depth)
+        self.ser = ser
+
+    def _receive_one(self):
+        length = self.pending[0].length
+        data = self.ser.read(length)
+        if len(data) < length:
+            raise TimeoutError(f"expected {length} response bytes, got {len(data)}")
+        return self._received(data)
+
+    def submit(self, req):
+        """Send a request as soon as the bridge has room for it. Returns
+        the request; its data is filled in by a later receive."""
+        while not self._can_send():
+            self._receive_one()
+        self.ser.write(req.frame)
+        self._sent(req)
+        return req
+
+    def flush(self):
+        """Wait for the responses of all requests sent so far."""
+        while self.pending:
+            self._receive_one()
+
+    def write(self, addr, data):
+        return self.submit(self.write_request(addr, data))
+
+    def read_nowait(self, addr, num_bytes):
+        return self.submit(self.read_request(addr, num_bytes))
+
+    def result(self, req):
+        """Wait for and return the response data of a read request."""
+        while not req.done:
+            self._receive_one()
+        return req.data
+
+    def read(self, addr, num_bytes):
+        return self.result(self.read_nowait(addr, num_bytes))
+
+    def write_block(self, addr, data):
+        """Write a buffer of any length starting at addr."""
+        data = as_bytes(data)
+        for offset, a, n in self.blocks(addr, len(data)):
+            self.write(a, data[offset:offset + n])
+
+    def read_block(self, addr, length):
+        """Read length bytes starting at addr. Returns a bytearray."""
+        reqs = [(offset, self.read_nowait(a, n)) for offset, a, n in self.blocks(addr, length)]
+        if(reqs):
+            self.result(reqs[-1][1])
+        return self.assemble(reqs, length)
+
+    def write_words(self, addrs, words):
+        """Write one word to each of addrs."""
+        if(len(addrs)):
+            self.submit(self.word_writes_request(addrs, words))
+
+    def read_words(self, addr, count):
+        """Read count consecutive words starting at addr."""
+        return decode_words(self.read_block(addr, 4 * count))
+
+class ThreadedDbgBridge(SerialDbgBridge):
+    """Client on a pyserial port with a reader thread.
+
+    The reader thread appends whatever arrives to a buffer and hands
+    complete responses to the oldest pending read, so a read completes
+    as soon as its last byte arrives instead of after a fixed sleep.
+    Same API as SerialDbgBridge; call close() when done.
+
+    timeout -- Seconds to wait for room to send or for a response
+    """
+
+    def __init__(self, ser, fifo_depth=DbgBridgeClient.FIFO_DEPTH, timeout=1.0):
+        super().__init__(ser, fifo_depth)
+        self.timeout = timeout
+        self.stray_bytes = 0
+        self._buffer = bytearray()
+        self._error = None
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._reader, name="dbg-bridge-reader", daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while self._running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+
+            if not data:
+                continue
+
+            with self._cond:
+                if not self.pending:
+                    # Nothing was asked for; never let it shift later responses.
+                    self.stray_bytes += len(data)
+                    continue
+
+                self._buffer += data
+                while self.pending and len(self._buffer) >= self.pending[0].length:
+                    length = self.pending[0].length
+                    self._received(self._buffer[:length])
+                    del self._buffer[:length]
+                self._cond.notify_all()
+
+    def _wait(self, predicate, what):
+        with self._cond:
+            if not self._cond.wait_for(lambda: predicate() or self._error is not None, self.timeout):
+                raise TimeoutError(f"timed out waiting for {what} ({self.outstanding} response bytes outstanding)")
+            if self._error is not None:
+                raise self._error
+
+    def submit(self, req):
+        """Send a request as soon as the bridge has room for it. Returns
+        the request; its data is filled in by the reader thread."""
+        self._wait(self._can_send, "room to send")
+        with self._cond:
+            # Registered before sending so that the response is never
+            # seen before its request.
+            self._sent(req)
+        self.ser.write(req.frame)
+        return req
+
+    def result(self, req):
+        """Wait for and return the response data of a read request."""
+        self._wait(lambda: req.done, "a response")
+        return req.data
+
+    def flush(self):
+        """Wait for the responses of all requests sent so far."""
+        self._wait(lambda: not self.pending, "all responses")
+
+    def resync(self):
+        """Forget all pending reads and buffered bytes, e.g. after an
+        interrupted request. Late responses are counted as stray."""
+        with self._cond:
+            self.pending.clear()
+            self.outstanding = 0
+            self._buffer.clear()
+        self.ser.reset_input_buffer()
+
+    def close(self):
+        """Stop the reader thread. The port is left open."""
+        self._running = False
+        self._thread.join((self.ser.timeout or 0) + self.timeout)
+
+class CocotbDbgBridge(DbgBridgeClient):
+    """cocotb client on a cocotbext.uart UartSource/UartSink pair."""
+
+    def __init__(self, src, snk, fifo_depth=DbgBridgeClient.FIFO_DEPTH):
+        super().__init__(fifo_depth)
+
+        # Only imported here so that the serial client works without cocotb.
+        import cocotb
+        from cocotb.triggers import Event
+
+        self.src = src
+        self.snk = snk
+        self._event = Event
+        self._start_soon = cocotb.start_soon
+        self._sent_event = Event()
+        self._received_event = Event()
+        self._receiver = self._start_soon(self._receive())
+
+    async def _receive(self):
+        while True:
+            while not self.pending:
+                self._sent_event.clear()
+                await self._sent_event.wait()
+
+            # UartSink.read(count) only waits for the first byte, so
+            # collect the response as it arrives. Bytes of the next
+            # response stay in the sink.
+            length = self.pending[0].length
+            data = bytearray()
+            while len(data) < length:
+                data += await self.snk.read(min(length - len(data), max(self.snk.count(), 1)))
+            req = self._received(data)
+            req.event.set()
+            self._received_event.set()
+
+    async def submit(self, req):
+        """Queue a request as soon as the bridge has room for it.
+        Returns the request; await result(req) for its data."""
+        while not self._can_send():
+            self._received_event.clear()
+            await self._received_event.wait()
+
+        req.event = self._event()
+        await self.src.write(req.frame)
+        self._sent(req)
+        self._sent_event.set()
+        return req
+
+    async def result(self, req):
+        """Wait for and return the response data of a read request."""
+        if not req.done:
+            await req.event.wait()
+        return req.data
+
+    async def flush(self):
+        """Wait until every request so far is on the wire (submit only
+        queues the frame in the UartSource) and every response has
+        arrived."""
+        await self.src.wait()
+        while self.pending:
+            self._received_event.clear()
+            await self._received_event.wait()
+
+    def resync(self):
+        """Forget all pending reads and any bytes received but not yet
+        matched to one, e.g. after resetting a hung bridge."""
+        self._receiver.kill()
+        self.pending.clear()
+        self.outstanding = 0
+        self.snk.clear()
+        self._receiver = self._start_soon(self._receive())
+        self._received_event.set()
+
+    async def write(self, addr, data):
+        return await self.submit(self.write_request(addr, data))
+
+    async def read_nowait(self, addr, num_bytes):
+        return await self.submit(self.read_request(addr, num_bytes))
+
+    async def read(self, addr, num_bytes):
+        return await self.result(await self.read_nowait(addr, num_bytes))
+
+    async def write_block(self, addr, data):
+        """Write a buffer of any length starting at addr."""
+        data = as_bytes(data)
+        for offset, a, n in self.blocks(addr, len(data)):
+            await self.write(a, data[offset:offset + n])
+
+    async def read_block(self, addr, length):
+        """Read length bytes starting at addr. Returns a bytearray."""
+        reqs = [(offset, await self.read_nowait(a, n)) for offset, a, n in self.blocks(addr, length)]
+        for offset, req in reqs:
+            await self.result(req)
+        return self.assemble(reqs, length)
+
+    async def write_words(self, addrs, words):
+        """Write one word to each of addrs."""
+        if(len(addrs)):
+            await self.submit(self.word_writes_request(addrs, words))
+
+    async def read_words(self, addr, count):
+        """Read count consecutive words starting at addr."""
+        return decode_words(await self.read_block(addr, 4 * count))
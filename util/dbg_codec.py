@@ -0,0 +1,155 @@
+# Frame encoding and response decoding for the dbg_bridge UART protocol
+# (see dbg_client.py for the frame format).
+#
+# Frames are built with struct/bytearray/memoryview instead of lists of
+# ints, and arrays of words are encoded and decoded in one call. NumPy is
+# used for that when it is installed; otherwise struct does the same
+# thing a little slower.
+
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+REQ_WRITE = 0x10
+REQ_READ = 0x11
+
+# The length field is 8 bits wide.
+MAX_LENGTH = 255
+
+# cmd, len, addr (big-endian)
+HEADER = struct.Struct(">BBI")
+# One little-endian data word
+WORD = struct.Struct("<I")
+# A single-word write frame: header followed by one data word
+WORD_WRITE = struct.Struct(">BBI4s")
+
+if(np is not None):
+    # One single-word write frame per element, for batch encoding
+    WORD_WRITE_DTYPE = np.dtype([("cmd", "u1"), ("len", "u1"), ("addr", ">u4"), ("data", "<u4")])
+    WORD_READ_DTYPE = np.dtype([("cmd", "u1"), ("len", "u1"), ("addr", ">u4")])
+
+def as_bytes(data):
+    """ Get a flat byte view of data without copying it where possible.
+    Accepts bytes, bytearray, memoryview, NumPy arrays (in their
+    in-memory byte order) and lists of ints.
+
+    Arguments:
+    data -- Buffer to view
+    """
+    try:
+        view = memoryview(data)
+    except TypeError:
+        return memoryview(bytes(data))
+    if(not view.c_contiguous):
+        view = memoryview(view.tobytes())
+    return view.cast('B')
+
+def encode_header(cmd, addr, length):
+    """ Encode the 6-byte command header.
+
+    Arguments:
+    cmd -- REQ_WRITE or REQ_READ
+    addr -- 32-bit address
+    length -- Number of data bytes, 1 to MAX_LENGTH
+    """
+    assert 1 <= length <= MAX_LENGTH, f"length must be 1..{MAX_LENGTH}"
+    return HEADER.pack(cmd, length, addr & 0xFFFFFFFF)
+
+def encode_write(addr, data):
+    """ Encode a write frame. Returns a bytearray.
+
+    Arguments:
+    addr -- Start address
+    data -- Bytes to write (any buffer, see as_bytes)
+    """
+    data = as_bytes(data)
+    assert 1 <= len(data) <= MAX_LENGTH, f"length must be 1..{MAX_LENGTH}"
+    frame = bytearray(HEADER.size + len(data))
+    HEADER.pack_into(frame, 0, REQ_WRITE, len(data), addr & 0xFFFFFFFF)
+    frame[HEADER.size:] = data
+    return frame
+
+def encode_read(addr, length):
+    """ Encode a read frame.
+
+    Arguments:
+    addr -- Start address
+    length -- Number of bytes to read
+    """
+    return encode_header(REQ_READ, addr, length)
+
+def encode_word(word):
+    """Encode a 32-bit word (little-endian)."""
+    return WORD.pack(word & 0xFFFFFFFF)
+
+def decode_word(data, offset=0):
+    """Decode a 32-bit word (little-endian) at offset."""
+    return WORD.unpack_from(as_bytes(data), offset)[0]
+
+def encode_words(words):
+    """ Encode a sequence of 32-bit words as little-endian bytes.
+
+    Arguments:
+    words -- List or NumPy array of words
+    """
+    if(np is not None):
+        return np.asarray(words).astype("<u4").tobytes()
+    return struct.pack(f"<{len(words)}I", *(w & 0xFFFFFFFF for w in words))
+
+def decode_words(data):
+    """ Decode little-endian bytes into 32-bit words. Returns a NumPy
+    array (a view of data, no copy) when NumPy is installed, a list
+    otherwise.
+
+    Arguments:
+    data -- Buffer whose length is a multiple of 4
+    """
+    data = as_bytes(data)
+    assert len(data) % 4 == 0, "length must be a multiple of 4"
+    if(np is not None):
+        return np.frombuffer(data, dtype="<u4")
+    return list(struct.unpack(f"<{len(data) // 4}I", data))
+
+def encode_word_writes(addrs, words):
+    """ Encode one single-word write frame per (address, word) pair,
+    back to back in one buffer.
+
+    Arguments:
+    addrs -- Word addresses
+    words -- Data words, same length as addrs
+    """
+    assert len(addrs) == len(words), "addrs and words must have the same length"
+    if(np is not None):
+        frames = np.empty(len(addrs), dtype=WORD_WRITE_DTYPE)
+        frames["cmd"] = REQ_WRITE
+        frames["len"] = 4
+        frames["addr"] = np.asarray(addrs, dtype=np.uint64) & 0xFFFFFFFF
+        frames["data"] = np.asarray(words, dtype=np.uint64) & 0xFFFFFFFF
+        return frames.tobytes()
+
+    out = bytearray(WORD_WRITE.size * len(addrs))
+    for i, (a, w) in enumerate(zip(addrs, words)):
+        WORD_WRITE.pack_into(out, i * WORD_WRITE.size, REQ_WRITE, 4, a & 0xFFFFFFFF, encode_word(w))
+    return out
+
+def encode_word_reads(addrs):
+    """ Encode one single-word read frame per address, back to back in
+    one buffer. The responses decode with decode_words.
+
+    Arguments:
+    addrs -- Word addresses
+    """
+    if(np is not None):
+        frames = np.empty(len(addrs), dtype=WORD_READ_DTYPE)
+        frames["cmd"] = REQ_READ
+        frames["len"] = 4
+        frames["addr"] = np.asarray(addrs, dtype=np.uint64) & 0xFFFFFFFF
+        return frames.tobytes()
+
+    out = bytearray(HEADER.size * len(addrs))
+    for i, a in enumerate(addrs):
+        HEADER.pack_into(out, i * HEADER.size, REQ_READ, 4, a & 0xFFFFFFFF)
+    return out
@@ -0,0 +1,366 @@
+# Reference model and scoreboard for the debug bridge in uart_axi
+# (part3/uart-axi: dbg_bridge + axi_ram + GPIO).
+#
+# DbgBridgeModel is a transaction-level model: it takes the byte stream
+# the host sends and returns the bytes the bridge answers with, and
+# (optionally) the AXI transactions the bridge issues on the dbg_* bus.
+# The emulator in fpga_emulator.py uses it as the uart_axi design.
+#
+# DbgBridgeScoreboard runs the model next to the DUT in cocotb. It
+# watches the UART lines and the dbg_* bus itself, so it works with any
+# stimulus, and compares each AXI transaction and response byte as soon
+# as both sides have produced it. Nothing is kept once it has been
+# checked, so memory use does not grow with the length of the run, and
+# the test fails at the first mismatch.
+
+import collections
+
+from dbg_codec import REQ_WRITE, REQ_READ
+from dbg_client import GPIO_ADDRESS, STS_ADDRESS, MEM_SIZE
+
+# One AXI transaction on the dbg_* bus. dbg_bridge never bursts, so
+# each is a single word: data is the 4 bytes of wdata/rdata in bus
+# order, strb the write strobes.
+AxiWrite = collections.namedtuple("AxiWrite", "addr data strb")
+AxiRead = collections.namedtuple("AxiRead", "addr data")
+
+# Value of the status register while the bridge is not busy
+STS_VALUE = 0xCAFE0000
+
+class DbgBridgeModel:
+    """Transaction-level model of dbg_bridge with axi_ram and GPIO.
+
+    Like the RTL, the bridge walks a frame one word at a time: RAM
+    accesses advance the address, GPIO/STS accesses do not (a longer
+    read repeats the register). An access to any other address never
+    gets an AXI response, so the real bridge hangs; the model does the
+    same and ignores everything after it (see hung).
+
+    buttons -- Value of buttons_i
+    sparse -- Keep the RAM in a dict of the bytes written so far instead
+              of a MEM_SIZE bytearray
+    track_axi -- Append the expected AXI transactions to axi
+    """
+
+    def __init__(self, buttons=0, sparse=False, track_axi=False):
+        self.mem = {} if sparse else bytearray(MEM_SIZE)
+        self.buttons = buttons
+        self.gpio_outputs = 0
+        self.hung = False
+        self.frames = 0
+        self.axi = collections.deque() if track_axi else None
+        self._rx = bytearray()
+        # data_q in dbg_bridge; a word keeps the bytes of the previous
+        # one where it is not written, and GPIO writes take all of it
+        self._data = bytearray(4)
+
+    @property
+    def leds(self):
+        return self.gpio_outputs & 0x1F
+
+    def reset(self):
+        """Reset the bridge and GPIO state, as reset_i does. The RAM
+        is not reset."""
+        self.gpio_outputs = 0
+        self.hung = False
+        self._rx.clear()
+        self._data[:] = bytes(4)
+        if(self.axi is not None):
+            self.axi.clear()
+
+    def load(self, addr, length):
+        """ Read length bytes of the RAM image starting at addr.
+
+        Arguments:
+        addr -- RAM byte address
+        length -- Number of bytes
+        """
+        if(isinstance(self.mem, dict)):
+            return bytes(self.mem.get(a, 0) for a in range(addr, addr + length))
+        return bytes(self.mem[addr:addr + length])
+
+    def store(self, addr, data):
+        """ Write bytes to the RAM image starting at addr.
+
+        Arguments:
+        addr -- RAM byte address
+        data -- Bytes to write
+        """
+        if(isinstance(self.mem, dict)):
+            for i, b in enumerate(data):
+                self.mem[addr + i] = b
+        else:
+            self.mem[addr:addr + len(data)] = data
+
+    def _word(self, addr):
+        if(addr == GPIO_ADDRESS):
+            return (self.buttons & 0xF).to_bytes(4, "little")
+        if(addr == STS_ADDRESS):
+            return STS_VALUE.to_bytes(4, "little")
+        word = self.load(addr & ~3, 4)
+        if(self.axi is not None):
+            self.axi.append(AxiRead(addr & ~3, word))
+        return word
+
+    def _is_mapped(self, addr):
+        return addr in (GPIO_ADDRESS, STS_ADDRESS) or (addr >> 12) == 0
+
+    def _write(self, addr, data):
+        idx = addr & 3
+        first = idx
+        for i, b in enumerate(data):
+            if(not self._is_mapped(addr)):
+                self.hung = True
+                return
+            self._data[idx] = b
+            if(idx == 3 or i == len(data) - 1):
+                if(addr == GPIO_ADDRESS):
+                    self.gpio_outputs = int.from_bytes(self._data, "little")
+                elif(addr != STS_ADDRESS):
+                    base = addr & ~3
+                    self.store(base + first, self._data[first:idx + 1])
+                    if(self.axi is not None):
+                        strb = ((1 << (idx + 1)) - 1) & ~((1 << first) - 1)
+                        self.axi.append(AxiWrite(base, bytes(self._data), strb))
+            idx = (idx + 1) & 3
+            if(idx == 0):
+                first = 0
+                if(addr not in (GPIO_ADDRESS, STS_ADDRESS)):
+                    addr = (addr & ~3) + 4
+
+    def _read(self, addr, length):
+        out = bytearray()
+        idx = addr & 3
+        while len(out) < length:
+            if(not self._is_mapped(addr)):
+                self.hung = True
+                break
+            word = self._word(addr)
+            take = min(4 - idx, length - len(out))
+            out += word[idx:idx + take]
+            idx = 0
+            if(addr not in (GPIO_ADDRESS, STS_ADDRESS)):
+                addr = (addr & ~3) + 4
+        return bytes(out)
+
+    def receive(self, data):
+        """ Feed bytes from the host. Returns the bytes the bridge sends
+        back. Partial frames are kept until the rest arrives.
+
+        Arguments:
+        data -- Bytes received on rx_serial_i
+        """
+        if(self.hung):
+            return b""
+
+        self._rx += data
+        out = bytearray()
+        while len(self._rx) >= 6 and not self.hung:
+            cmd, length = self._rx[0], self._rx[1]
+            addr = int.from_bytes(self._rx[2:6], "big")
+            if(cmd == REQ_WRITE):
+                if(len(self._rx) < 6 + length):
+                    break
+                self._write(addr, self._rx[6:6 + length])
+                del self._rx[:6 + length]
+            elif(cmd == REQ_READ):
+                out += self._read(addr, length)
+                del self._rx[:6]
+            else:
+                # The bridge ignores anything but a command byte in IDLE
+                del self._rx[:1]
+                continue
+            self.frames += 1
+        return bytes(out)
+
+class DbgBridgeScoreboard:
+    """Checks uart_axi against DbgBridgeModel while a test runs.
+
+    Requests are taken from rx_serial_i, so the scoreboard checks
+    whatever drives the bridge. Every AXI transaction on the dbg_* bus
+    and every byte on tx_serial_o is compared, in order, with the model
+    as soon as both are known; the first mismatch fails the test.
+
+    Create it after reset, before the first request, with the baud rate
+    of the UARTs. buttons_i is sampled when each request arrives. At
+    the end of the test, await drain(source=...) to check that nothing
+    expected is still missing.
+
+    frames -- Requests the model has executed
+    axi_checked -- AXI transactions checked
+    bytes_checked -- Response bytes checked
+    """
+
+    def __init__(self, dut, baud, model=None):
+        # Only imported here so that the model works without cocotb.
+        import cocotb
+        from cocotb.triggers import Event
+        from cocotbext.uart import UartSink
+
+        self.dut = dut
+        self.model = model or DbgBridgeModel(sparse=True, track_axi=True)
+        assert self.model.axi is not None, "The model must be created with track_axi=True"
+        self.axi_checked = 0
+        self.bytes_checked = 0
+        self.errors = []
+
+        self._axi = collections.deque()
+        self._expected = bytearray()
+        self._received = bytearray()
+        self._aw = collections.deque()
+        self._w = collections.deque()
+        self._ar = collections.deque()
+        self._changed = Event()
+
+        self._rx = UartSink(dut.rx_serial_i, baud=baud, bits=8, stop_bits=1)
+        self._tx = UartSink(dut.tx_serial_o, baud=baud, bits=8, stop_bits=1)
+        cocotb.start_soon(self._watch_requests())
+        cocotb.start_soon(self._watch_responses())
+        cocotb.start_soon(self._watch_valid(dut.dbg_awvalid, self._on_aw))
+        cocotb.start_soon(self._watch_valid(dut.dbg_wvalid, self._on_w))
+        cocotb.start_soon(self._watch_valid(dut.dbg_arvalid, self._on_ar))
+        cocotb.start_soon(self._watch_valid(dut.dbg_rvalid, self._on_r))
+        cocotb.start_soon(self._watch_valid(dut.dbg_bvalid, self._on_b))
+
+    @property
+    def frames(self):
+        return self.model.frames
+
+    def _fail(self, msg):
+        self.errors.append(msg)
+        self.dut._log.error(f"Scoreboard: {msg}")
+        raise AssertionError(msg)
+
+    async def _watch_requests(self):
+        while True:
+            data = await self._rx.read()
+            self.model.buttons = int(self.dut.buttons_i.value)
+            self._expected += self.model.receive(data)
+            self._compare()
+
+    async def _watch_responses(self):
+        while True:
+            self._received += await self._tx.read()
+            self._compare()
+
+    async def _watch_valid(self, valid, handler):
+        # Valid is registered and drops after every handshake in
+        # dbg_bridge and axi_ram (one word in flight at a time), so
+        # each rising edge is one transfer, and the payload is held
+        # until the handshake.
+        from cocotb.triggers import RisingEdge, ReadOnly
+
+        while True:
+            await RisingEdge(valid)
+            await ReadOnly()
+            handler()
+            self._compare()
+
+    def _on_aw(self):
+        self._aw.append(int(self.dut.dbg_awaddr.value))
+        self._pair_write()
+
+    def _on_w(self):
+        self._w.append((int(self.dut.dbg_wdata.value), int(self.dut.dbg_wstrb.value)))
+        self._pair_write()
+
+    def _pair_write(self):
+        if(self._aw and self._w):
+            wdata, wstrb = self._w.popleft()
+            self._axi.append(AxiWrite(self._aw.popleft(), wdata.to_bytes(4, "little"), wstrb))
+
+    def _on_ar(self):
+        self._ar.append(int(self.dut.dbg_araddr.value))
+
+    def _on_r(self):
+        rresp = int(self.dut.dbg_rresp.value)
+        if(rresp != 0):
+            self._fail(f"AXI read error response {rresp}")
+        self._axi.append(AxiRead(self._ar.popleft(), int(self.dut.dbg_rdata.value).to_bytes(4, "little")))
+
+    def _on_b(self):
+        bresp = int(self.dut.dbg_bresp.value)
+        if(bresp != 0):
+            self._fail(f"AXI write error response {bresp}")
+
+    def _compare(self):
+        expected = self.model.axi
+        while self._axi and expected:
+            got, exp = self._axi.popleft(), expected.popleft()
+            if(isinstance(exp, AxiWrite)):
+                mask = int.from_bytes(bytes(0xFF if exp.strb >> i & 1 else 0 for i in range(4)), "little")
+                match = isinstance(got, AxiWrite) and got.addr == exp.addr and got.strb == exp.strb \
+                    and int.from_bytes(got.data, "little") & mask == int.from_bytes(exp.data, "little") & mask
+            else:
+                match = got == exp
+            if(not match):
+                self._fail(f"AXI transaction {self.axi_checked}: got {self._format(got)}, expected {self._format(exp)}")
+            self.axi_checked += 1
+
+        n = min(len(self._received), len(self._expected))
+        if(n):
+            if(self._received[:n] != self._expected[:n]):
+                i = next(i for i in range(n) if self._received[i] != self._expected[i])
+                self._fail(f"Response byte {self.bytes_checked + i}: got 0x{self._received[i]:02X}, "
+                           f"expected 0x{self._expected[i]:02X} (request {self.model.frames})")
+            del self._received[:n]
+            del self._expected[:n]
+            self.bytes_checked += n
+        self._changed.set()
+
+    @staticmethod
+    def _format(txn):
+        if(isinstance(txn, AxiWrite)):
+            return f"write 0x{txn.addr:08X} data {txn.data.hex()} strb {txn.strb:04b}"
+        return f"read 0x{txn.addr:08X} data {txn.data.hex()}"
+
+    def reset(self):
+        """Drop everything not yet checked and reset the model, after
+        the DUT has been reset (e.g. to recover from a hung bridge).
+        Call it once the reset is over and the lines are idle."""
+        self.model.reset()
+        self._axi.clear()
+        self._aw.clear()
+        self._w.clear()
+        self._ar.clear()
+        self._expected.clear()
+        self._received.clear()
+        self._rx.clear()
+        self._tx.clear()
+
+    def missing(self):
+        """Number of AXI transactions and response bytes the model
+        expects that have not been seen yet."""
+        return len(self.model.axi) + len(self._expected)
+
+    async def drain(self, timeout=10, unit='ms', hang=False, source=None):
+        """ Wait until everything the model expects has been seen and
+        checked, then check that nothing else was.
+
+        Arguments:
+        timeout -- Time to wait before failing
+        unit -- Unit of timeout
+        hang -- The last request went outside RAM/GPIO/STS, so the
+                bridge is expected to hang after whatever it did before
+                (its access to the bad address is not checked)
+        source -- UartSource driving rx_serial_i. The model only learns
+                  of a request once it is on the wire, so frames still
+                  queued there would not count as missing; drain waits
+                  for it to go idle first.
+        """
+        from cocotb.triggers import with_timeout
+
+        async def wait():
+            if(source is not None):
+                await source.wait()
+            while self.missing() or (hang and not self.model.hung):
+                self._changed.clear()
+                await self._changed.wait()
+
+        await with_timeout(wait(), timeout, unit)
+        assert not self.errors, self.errors[0]
+        if(hang):
+            return
+        assert not self.model.hung, "The bridge was sent an access outside RAM/GPIO/STS"
+        assert not self._axi, f"Unexpected AXI transaction: {self._format(self._axi[0])}"
+        assert not self._received, f"Unexpected response bytes: {self._received.hex()}"
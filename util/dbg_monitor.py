@@ -0,0 +1,206 @@
+# Monitor for the dbg_bridge in uart_axi. It watches the dbg_* AXI bus
+# between the bridge and axi_ram/GPIO, and the bridge's command state,
+# so that tests can wait exactly as long as the DUT needs instead of
+# sleeping for a fixed time. DbgBridgeCoverage collects functional
+# coverage of the same state machine.
+
+import cocotb
+
+from cocotb.triggers import Edge, RisingEdge, ReadOnly, Event, with_timeout
+from cocotb.utils import get_sim_time
+
+import func_coverage
+
+from dbg_client import GPIO_ADDRESS, STS_ADDRESS
+
+# State encoding of dbg_bridge.v
+STATE_IDLE = 0
+STATE_LEN = 2
+STATE_ADDR3 = 6
+STATE_WRITE = 7
+STATE_READ = 8
+STATE_DATA0 = 9
+STATE_DATA3 = 12
+
+STATE_NAMES = {0: "IDLE", 2: "LEN", 3: "ADDR0", 4: "ADDR1", 5: "ADDR2", 6: "ADDR3", 7: "WRITE",
+               8: "READ", 9: "DATA0", 10: "DATA1", 11: "DATA2", 12: "DATA3"}
+
+# Every transition next_state_r can make
+STATE_ARCS = [("IDLE", "LEN"), ("LEN", "ADDR0"), ("ADDR0", "ADDR1"), ("ADDR1", "ADDR2"), ("ADDR2", "ADDR3"),
+              ("ADDR3", "WRITE"), ("ADDR3", "READ"), ("WRITE", "IDLE"), ("READ", "DATA0"),
+              ("DATA0", "DATA1"), ("DATA0", "IDLE"), ("DATA1", "DATA2"), ("DATA1", "IDLE"),
+              ("DATA2", "DATA3"), ("DATA2", "IDLE"), ("DATA3", "READ"), ("DATA3", "IDLE")]
+
+# Request length bins: upper bound (inclusive) -> name
+LENGTH_BINS = [(0, "0"), (1, "1"), (2, "2"), (3, "3"), (4, "4"), (8, "5-8"), (16, "9-16"),
+               (64, "17-64"), (128, "65-128"), (254, "129-254"), (255, "255")]
+
+class DbgBridgeMonitor:
+    """Counts completed bridge commands and AXI responses in uart_axi.
+
+    writes -- Write commands the bridge has finished (and acknowledged)
+    reads -- Read commands whose data has been handed to the UART
+    bresps -- AXI write responses on dbg_b* (RAM writes only)
+    rbeats -- AXI read beats on dbg_r* (RAM reads only)
+
+    GPIO/STS accesses never reach the AXI bus, so only writes/reads
+    count them.
+
+    idle_time() gives the time the bridge has spent in IDLE, accumulated
+    on state changes rather than sampled every cycle. The monitor must
+    be created while the bridge is idle (after reset).
+    """
+
+    def __init__(self, dut):
+        self.dut = dut
+        self.writes = 0
+        self.reads = 0
+        self.bresps = 0
+        self.rbeats = 0
+        self._idle_ps = 0
+        self._idle_since = get_sim_time('ps')
+        self._changed = Event()
+
+        cocotb.start_soon(self._watch_state(dut.u_dbg_bridge.state_q))
+        cocotb.start_soon(self._watch_valid(dut.dbg_bvalid, "bresps"))
+        cocotb.start_soon(self._watch_valid(dut.dbg_rvalid, "rbeats"))
+
+    async def _watch_state(self, state_q):
+        last = STATE_IDLE
+        while True:
+            await Edge(state_q)
+            if not state_q.value.is_resolvable:
+                continue
+
+            state = int(state_q.value)
+            now = get_sim_time('ps')
+            if self._idle_since is not None:
+                self._idle_ps += now - self._idle_since
+            self._idle_since = now if state == STATE_IDLE else None
+
+            if state == STATE_IDLE:
+                if last == STATE_WRITE:
+                    self.writes += 1
+                elif STATE_DATA0 <= last <= STATE_DATA3:
+                    self.reads += 1
+                self._changed.set()
+            last = state
+
+    async def _watch_valid(self, valid, count):
+        # Every rising edge of valid is exactly one beat, because
+        # bready/rready are tied high in dbg_bridge and it never bursts
+        # (awlen/arlen are 0): valid drops after each single-beat
+        # response. With bursts, valid could stay high across beats
+        # and this would undercount; count valid && ready on the clock
+        # instead.
+        while True:
+            await RisingEdge(valid)
+            setattr(self, count, getattr(self, count) + 1)
+            self._changed.set()
+
+    async def _wait(self, count, target, timeout, unit):
+        async def wait():
+            while getattr(self, count) < target:
+                self._changed.clear()
+                await self._changed.wait()
+
+        await with_timeout(wait(), timeout, unit)
+
+    def idle_time(self):
+        """Simulation time (in ps) the bridge has spent in IDLE since
+        the monitor was created."""
+        idle = self._idle_ps
+        if self._idle_since is not None:
+            idle += get_sim_time('ps') - self._idle_since
+        return idle
+
+    def write_ack(self, n=1, timeout=100, unit='ms'):
+        """Wait until n more write commands have been acknowledged. The
+        count starts when this is called, so call it right after
+        queueing the command(s) and before the bridge can finish them.
+        """
+        return self._wait("writes", self.writes + n, timeout, unit)
+
+    def read_done(self, n=1, timeout=100, unit='ms'):
+        """Wait until the bridge has fetched the data of n more read
+        commands. The UART may still be sending it; use
+        utilities.wait_uart_bytes to wait for the response itself.
+        """
+        return self._wait("reads", self.reads + n, timeout, unit)
+
+class DbgBridgeCoverage:
+    """Functional coverage of dbg_bridge in uart_axi, in the "dbg_bridge"
+    cover group (see func_coverage.py):
+
+    state -- States visited
+    arc -- State transitions, with an "other" bin for any that is not
+           in STATE_ARCS (e.g. back to IDLE on reset)
+    command -- Request type (write/read)
+    length -- Request length, binned by LENGTH_BINS
+    region -- Target: aligned or unaligned RAM, GPIO, STS or unmapped
+    command_length, command_region -- Crosses
+
+    Everything is sampled on changes of state_q, the same edges the
+    monitor waits on, rather than every clock. Does nothing unless
+    coverage is enabled. Create it after reset.
+    """
+
+    def __init__(self, dut):
+        if(not func_coverage.enabled()):
+            return
+
+        self.dut = dut
+        cg = func_coverage.group("dbg_bridge")
+        self.state = cg.point("state", STATE_NAMES.values())
+        self.arc = cg.point("arc", [f"{a}->{b}" for a, b in STATE_ARCS] + ["other"])
+        self.command = cg.point("command", ["write", "read"])
+        self.length = cg.point("length", [name for bound, name in LENGTH_BINS])
+        self.region = cg.point("region", ["ram_aligned", "ram_unaligned", "gpio", "sts", "unmapped"])
+        self.command_length = cg.cross("command_length", self.command, self.length)
+        self.command_region = cg.cross("command_region", self.command, self.region)
+
+        # (previous state, state) -> arc bin, as a flat table
+        other = self.arc.index("other")
+        self._arcs = [other] * 256
+        names = {n: s for s, n in STATE_NAMES.items()}
+        for a, b in STATE_ARCS:
+            self._arcs[names[a] << 4 | names[b]] = self.arc.index(f"{a}->{b}")
+        self._states = [self.state.index(STATE_NAMES[s]) if s in STATE_NAMES else None for s in range(16)]
+        self._lengths = [next(i for i, (bound, name) in enumerate(LENGTH_BINS) if n <= bound) for n in range(256)]
+
+        cocotb.start_soon(self._watch_state(dut.u_dbg_bridge))
+
+    def _region(self, addr):
+        if(addr == GPIO_ADDRESS):
+            return 2
+        if(addr == STS_ADDRESS):
+            return 3
+        if((addr >> 12) != 0):
+            return 4
+        return 0 if (addr & 3) == 0 else 1
+
+    async def _watch_state(self, bridge):
+        state_q = bridge.state_q
+        last = STATE_IDLE
+        while True:
+            await Edge(state_q)
+            await ReadOnly()
+            if not state_q.value.is_resolvable:
+                continue
+
+            state = int(state_q.value)
+            if self._states[state] is not None:
+                self.state.sample(self._states[state])
+            self.arc.sample(self._arcs[last << 4 | state])
+
+            # The request is complete once the bridge leaves ADDR3
+            if last == STATE_ADDR3 and state in (STATE_WRITE, STATE_READ):
+                command = 0 if state == STATE_WRITE else 1
+                length = self._lengths[int(bridge.len_q.value)]
+                region = self._region(int(bridge.mem_addr_q.value))
+                self.command.sample(command)
+                self.length.sample(length)
+                self.region.sample(region)
+                self.command_length.sample(command, length)
+                self.command_region.sample(command, region)
+            last = state
@@ -0,0 +1,200 @@
+# Constrained-random traffic for the debug bridge in uart_axi.
+#
+# DbgTrafficGenerator draws a reproducible (seeded) stream of requests:
+# RAM reads and writes of random length at aligned or unaligned
+# addresses, GPIO and status register accesses, and accesses outside
+# the address map. run_traffic() streams them through a CocotbDbgBridge
+# back to back for a number of requests or a time budget and returns
+# TrafficStats, the throughput in requests per simulated and per wall
+# second. The responses are not checked here; run a
+# dbg_model.DbgBridgeScoreboard alongside for that.
+#
+# An access outside RAM/GPIO/STS never gets an AXI response, so the
+# bridge hangs until reset. run_traffic() sends those on their own and
+# hands over to a recovery callback that resets the DUT.
+#
+# A stop callback (func_coverage.Saturation) ends the run early once
+# the requests stop hitting new coverage bins.
+
+import time
+import random
+import collections
+
+from dbg_codec import encode_write, encode_read
+from dbg_client import GPIO_ADDRESS, STS_ADDRESS, MEM_BASE, MEM_SIZE
+
+# Relative weight of each kind of request. out_of_range is off by
+# default, since it needs a recovery callback.
+DEFAULT_WEIGHTS = {"write": 35,
+                   "read": 35,
+                   "gpio_read": 8,
+                   "gpio_write": 4,
+                   "sts_read": 8,
+                   "out_of_range": 0}
+
+# One request. data is the payload of writes (None for reads), length
+# the number of bytes written or read.
+Traffic = collections.namedtuple("Traffic", "kind addr data length")
+
+class DbgTrafficGenerator:
+    """Seeded constrained-random request stream for dbg_bridge.
+
+    seed -- Seed of the generator's own random.Random
+    weights -- Kind -> relative weight, merged over DEFAULT_WEIGHTS
+    max_length -- Longest RAM access, in bytes (at most 255)
+    aligned -- Fraction of RAM accesses that start on a word boundary
+    """
+
+    def __init__(self, seed=None, weights=None, max_length=16, aligned=0.5):
+        assert 1 <= max_length <= 255, "max_length must fit the 8-bit length field"
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        assert set(self.weights) == set(DEFAULT_WEIGHTS), f"Unknown kinds in {sorted(self.weights)}"
+        self.max_length = max_length
+        self.aligned = aligned
+        self._kinds = list(self.weights)
+        self._kind_weights = list(self.weights.values())
+
+    def _ram_range(self):
+        length = self.rng.randint(1, self.max_length)
+        if(self.rng.random() < self.aligned):
+            addr = self.rng.randrange(0, MEM_SIZE, 4)
+        else:
+            addr = self.rng.randrange(0, MEM_SIZE)
+        return MEM_BASE + addr, min(length, MEM_SIZE - addr)
+
+    def _out_of_range(self):
+        choice = self.rng.randrange(3)
+        # Just past the RAM, past the registers, or a frame that starts
+        # in RAM and runs off its end.
+        if(choice == 0):
+            return MEM_BASE + MEM_SIZE + self.rng.randrange(0, 0x1000, 4), self.rng.randint(1, 8)
+        if(choice == 1):
+            return STS_ADDRESS + 4 * self.rng.randint(1, 16), self.rng.randint(1, 8)
+        length = self.rng.randint(2, 16)
+        return MEM_BASE + MEM_SIZE - self.rng.randint(1, length - 1), length
+
+    def next(self):
+        """Draw the next request."""
+        kind = self.rng.choices(self._kinds, self._kind_weights)[0]
+        if(kind in ("write", "read")):
+            addr, length = self._ram_range()
+        elif(kind == "gpio_write"):
+            addr, length = GPIO_ADDRESS, 4
+        elif(kind == "gpio_read"):
+            addr, length = GPIO_ADDRESS, self.rng.choice([1, 2, 4, 8])
+        elif(kind == "sts_read"):
+            addr, length = STS_ADDRESS, 4
+        else:
+            addr, length = self._out_of_range()
+
+        data = None
+        if(kind in ("write", "gpio_write") or (kind == "out_of_range" and self.rng.random() < 0.5)):
+            data = self.rng.randbytes(length)
+        return Traffic(kind, addr, data, length)
+
+    def __iter__(self):
+        while True:
+            yield self.next()
+
+class TrafficStats:
+    """Requests, bytes and time of one run_traffic() call.
+
+    requests -- Requests sent
+    kinds -- Kind -> requests sent
+    bytes -- Payload bytes written or read
+    sim_ns -- Simulated time
+    wall_s -- Wall-clock time
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.kinds = collections.Counter()
+        self.bytes = 0
+        self.sim_ns = 0
+        self.wall_s = 0
+
+    def add(self, traffic):
+        self.requests += 1
+        self.kinds[traffic.kind] += 1
+        self.bytes += traffic.length
+
+    @property
+    def per_sim_s(self):
+        return self.requests / (self.sim_ns * 1e-9) if self.sim_ns else 0
+
+    @property
+    def per_wall_s(self):
+        return self.requests / self.wall_s if self.wall_s else 0
+
+    def as_dict(self):
+        return {"requests": self.requests,
+                "bytes": self.bytes,
+                "sim_ns": self.sim_ns,
+                "wall_s": self.wall_s,
+                "requests_per_s": self.per_sim_s,
+                "requests_per_wall_s": self.per_wall_s,
+                "bytes_per_s": self.bytes / (self.sim_ns * 1e-9) if self.sim_ns else 0,
+                "kinds": dict(self.kinds)}
+
+    def __str__(self):
+        return (f"{self.requests} requests ({self.bytes} bytes) in {self.sim_ns / 1e6:.3f} sim ms / {self.wall_s:.2f} s: "
+                f"{self.per_sim_s:.0f} req/sim-s, {self.per_wall_s:.0f} req/wall-s")
+
+async def run_traffic(bridge, gen, count=None, sim_time=None, wall_time=None, recover=None, stop=None):
+    """ Stream requests from gen through bridge, back to back, until
+    count requests have been sent or a time budget runs out, then wait
+    for the outstanding responses. Returns TrafficStats.
+
+    Arguments:
+    bridge -- CocotbDbgBridge
+    gen -- DbgTrafficGenerator
+    count -- Number of requests
+    sim_time -- Simulated time budget, in ns
+    wall_time -- Wall-clock time budget, in seconds
+    recover -- async callable run after each out-of-range request; it
+               must reset the DUT (and any scoreboard) so the bridge
+               accepts requests again
+    stop -- callable checked before each request, e.g. a
+            func_coverage.Saturation; the run ends once it returns True
+    """
+    # Only imported here so that the generator works without cocotb.
+    from cocotb.utils import get_sim_time
+
+    assert count or sim_time or wall_time, "Give a request count or a time budget"
+    assert recover is not None or not gen.weights["out_of_range"], "Out-of-range requests need a recover callback"
+
+    stats = TrafficStats()
+    sim_start = get_sim_time('ns')
+    wall_start = time.perf_counter()
+
+    for traffic in gen:
+        if(count is not None and stats.requests >= count):
+            break
+        if(sim_time is not None and get_sim_time('ns') - sim_start >= sim_time):
+            break
+        if(wall_time is not None and time.perf_counter() - wall_start >= wall_time):
+            break
+        if(stop is not None and stop()):
+            break
+
+        if(traffic.kind == "out_of_range"):
+            # Sent behind the client's back: the bridge may answer part
+            # of a read before it hangs, and never the rest.
+            await bridge.flush()
+            frame = encode_write(traffic.addr, traffic.data) if traffic.data is not None else encode_read(traffic.addr, traffic.length)
+            await bridge.src.write(frame)
+            await bridge.src.wait()
+            await recover()
+            bridge.resync()
+        elif(traffic.data is not None):
+            await bridge.write(traffic.addr, traffic.data)
+        else:
+            await bridge.read_nowait(traffic.addr, traffic.length)
+        stats.add(traffic)
+
+    await bridge.flush()
+    stats.sim_ns = get_sim_time('ns') - sim_start
+    stats.wall_s = time.perf_counter() - wall_start
+    return stats
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Filelist resolver. Each module directory has a filelist.json with the
+top level module and the sources, relative to the repository root:
+
+{
+    "top": "hello",
+    "include": ["part1/common/filelist.json"],
+    "files":
+    ["part1/sim/hello.sv"
+    ]
+}
+
+"include" is optional: each included filelist's files come first (in
+order, each file once), and its top is ignored. resolve() reads a
+filelist and everything it includes in one pass and keeps the result
+for as long as none of those files' mtimes change, so the testbench
+helpers can ask for the top and the sources as often as they like.
+
+Make reads the same information from a generated fragment instead of
+starting Python for every variable:
+
+Usage:
+    python3 util/filelist.py make [-C DIR] [-o filelist.mk]
+    python3 util/filelist.py files|top|deps [-C DIR]
+
+The module Makefiles include filelist.mk (and regenerate it when a
+filelist changes); "files" and "top" print what util/get_filelist.py
+and util/get_top.py print.
+"""
+
+import os
+import json
+import argparse
+import collections
+import functools
+
+FILENAME = "filelist.json"
+
+# A resolved filelist. files are relative to the repository root,
+# depends are the absolute paths of every filelist read.
+Filelist = collections.namedtuple("Filelist", "top files depends")
+
+@functools.lru_cache(maxsize=None)
+def repo_root(start=None):
+    """ Get the repository root: $REPO_ROOT if set, else the nearest
+    directory above start (default: this file) with a .git entry.
+    Unlike git.Repo this only stats a few paths.
+
+    Arguments:
+    start -- Directory to search from
+    """
+    if(os.environ.get("REPO_ROOT")):
+        return os.path.realpath(os.environ["REPO_ROOT"])
+    path = os.path.realpath(start or os.path.dirname(os.path.abspath(__file__)))
+    while not os.path.exists(os.path.join(path, ".git")):
+        parent = os.path.dirname(path)
+        assert parent != path, f"No repository above {start}"
+        path = parent
+    return path
+
+# Path of a filelist -> (mtimes of the files it depends on, Filelist)
+_cache = {}
+
+def _mtimes(paths):
+    return tuple(os.stat(p).st_mtime_ns for p in paths)
+
+def _read(path, root, seen, files, depends):
+    assert path not in seen, f"Filelist include cycle through {path}"
+    seen.add(path)
+    depends.append(path)
+    with open(path) as fd:
+        data = json.load(fd)
+    for inc in data.get("include", []):
+        _read(os.path.join(root, inc), root, seen, files, depends)
+    for f in data["files"]:
+        if(f not in files):
+            files[f] = None
+    return data.get("top")
+
+def resolve(p, n=FILENAME, root=None):
+    """ Resolve a json filelist and the filelists it includes. The
+    result is cached until one of them changes.
+
+    Arguments:
+    p -- Directory containing the filelist
+    n -- Name of the filelist, defaults to filelist.json
+    root -- Repository root that the paths in the filelist are
+            relative to (default: repo_root())
+    """
+    path = os.path.realpath(os.path.join(p, n))
+    root = root or repo_root(p)
+    cached = _cache.get((path, root))
+    if(cached is not None):
+        try:
+            if(_mtimes(cached[1].depends) == cached[0]):
+                return cached[1]
+        except FileNotFoundError:
+            pass
+
+    files = {}
+    depends = []
+    top = _read(path, root, set(), files, depends)
+    assert top is not None, f"{path} has no top"
+    result = Filelist(top, list(files), depends)
+    _cache[(path, root)] = (_mtimes(depends), result)
+    return result
+
+def make_fragment(p, n=FILENAME, root=None):
+    """ Get the Make fragment for a module: the variables of
+    frag/simulate.mk and frag/synth.mk, as overrides so that those
+    files do not compute them again, and FILELIST_DEPS, the filelists
+    it was generated from. FILELIST_ROOT records the root, since the
+    source paths are absolute.
+
+    Arguments:
+    p -- Module directory
+    n -- Name of the filelist
+    root -- Repository root
+    """
+    root = root or repo_root(p)
+    fl = resolve(p, n, root)
+    sources = " ".join(os.path.join(root, f) for f in fl.files)
+    lines = ["# Generated by util/filelist.py from " + " ".join(os.path.relpath(d, root) for d in fl.depends) + ". Do not edit.",
+             f"override SIM_SOURCES := {sources}",
+             f"override SYNTH_SOURCES := {sources}",
+             f"override SIM_TOP := {fl.top}",
+             f"override ABSTRACT_TOP := {fl.top}",
+             f"FILELIST_ROOT := {root}",
+             "FILELIST_DEPS := " + " ".join(fl.depends)]
+    return "\n".join(lines) + "\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve a module's filelist.json.")
+    parser.add_argument("command", choices=["make", "files", "top", "deps"])
+    parser.add_argument("-C", dest="dir", default=".", help="Module directory (default: the current directory)")
+    parser.add_argument("-o", "--output", default=None, help="Write the output here instead of printing it")
+    args = parser.parse_args()
+
+    if(args.command == "make"):
+        out = make_fragment(args.dir)
+    else:
+        fl = resolve(args.dir)
+        out = {"files": " ".join(fl.files), "top": fl.top, "deps": " ".join(fl.depends)}[args.command] + "\n"
+
+    if(args.output is None):
+        print(out, end="")
+        return
+    # Written via a temporary file so that a parallel make never
+    # includes a half-written fragment.
+    tmp = args.output + ".tmp"
+    with open(tmp, "w") as fd:
+        fd.write(out)
+    os.replace(tmp, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Software stand-in for the FPGA designs, so that the host-side scripts
+(test_uart_axi_hardware.py, serialsend.py) run without a board.
+
+Two behavioural models of the RTL, byte stream in, byte stream out:
+- UartAxiModel: part3/uart-axi, the dbg_bridge protocol with the 4 KB
+  axi_ram at 0x00000000 and the GPIO/STS registers at
+  0xF0000000/0xF0000004 (dbg_model.DbgBridgeModel).
+- UartAxisModel: part3/uart-axis, the 32-bit loopback that turns
+  LED[1] on for the birthday code (0x00B835F2) and off for 0xC0C0FFEE.
+
+They can be used in-process through EmulatedSerial, a pyserial
+stand-in, or behind a pseudo terminal so that any tool can open them
+like a real port:
+
+Usage:
+    python3 util/fpga_emulator.py [--design uart_axi|uart_axis] [--baud BAUD] [--link PATH]
+
+With --baud (or baud=... for EmulatedSerial) bytes are paced at the
+UART line rate, so measured throughput matches the board; without it
+responses are immediate.
+"""
+
+import os
+import time
+import argparse
+import threading
+import collections
+
+from dbg_model import DbgBridgeModel
+
+# Mirrors part3/uart-axis/uart_axis.sv
+BIRTHDAY = 0x00B835F2
+OFF_CODE = 0xC0C0FFEE
+
+# 8N1: start + 8 data + stop bits per byte
+BITS_PER_BYTE = 10
+
+# part3/uart-axi is modelled by the scoreboard's reference model
+# (dbg_bridge + axi_ram + GPIO, see dbg_model.py).
+UartAxiModel = DbgBridgeModel
+
+class UartAxisModel:
+    """Behavioural model of uart_axis: bytes are packed four at a time
+    (first byte in the LSBs) into a 32-bit word that sets or clears
+    LED[1] and is looped back, so the echo arrives in groups of four.
+    """
+
+    def __init__(self):
+        self.led_state = 0
+        self.words = 0
+        self._rx = bytearray()
+
+    @property
+    def leds(self):
+        return self.led_state
+
+    def receive(self, data):
+        """ Feed bytes from the host. Returns the looped-back bytes.
+
+        Arguments:
+        data -- Bytes received on rx_serial_i
+        """
+        self._rx += data
+        full = len(self._rx) & ~3
+        out = bytes(self._rx[:full])
+        del self._rx[:full]
+        for i in range(0, full, 4):
+            word = int.from_bytes(out[i:i + 4], "little")
+            if(word == BIRTHDAY):
+                self.led_state = 1
+            elif(word == OFF_CODE):
+                self.led_state = 0
+            self.words += 1
+        return out
+
+MODELS = {"uart_axi": UartAxiModel, "uart_axis": UartAxisModel}
+
+class LinePacer:
+    """Tracks when bytes would finish crossing a UART link at baud, in
+    each direction. All times are time.monotonic() values."""
+
+    def __init__(self, baud):
+        self.byte_time = BITS_PER_BYTE / baud
+        self.rx_done = 0.0
+        self.tx_done = 0.0
+
+    def received(self, count):
+        """Host -> board: returns when the last of count bytes arrives."""
+        self.rx_done = max(time.monotonic(), self.rx_done) + count * self.byte_time
+        return self.rx_done
+
+    def sent(self, count):
+        """Board -> host: returns when the last of count bytes arrives."""
+        self.tx_done = max(self.rx_done, self.tx_done) + count * self.byte_time
+        return self.tx_done
+
+class EmulatedSerial:
+    """In-process stand-in for serial.Serial connected to a model.
+
+    Supports what the scripts use: write, read, in_waiting, timeout,
+    reset_input_buffer/reset_output_buffer, flush, close, is_open.
+
+    model -- UartAxiModel or UartAxisModel
+    baud -- If set, pace responses at this line rate
+    timeout -- Read timeout in seconds (None blocks)
+    """
+
+    def __init__(self, model, baud=None, timeout=1):
+        self.model = model
+        self.timeout = timeout
+        self.port = "emulator"
+        self.is_open = True
+        self._pacer = LinePacer(baud) if baud else None
+        self._rx = collections.deque()  # (ready time, bytes)
+        self._cond = threading.Condition()
+
+    def write(self, data):
+        data = bytes(data)
+        resp = self.model.receive(data)
+        ready = 0.0
+        if(self._pacer is not None):
+            self._pacer.received(len(data))
+            ready = self._pacer.sent(len(resp))
+        if(resp):
+            with self._cond:
+                self._rx.append((ready, bytearray(resp)))
+                self._cond.notify_all()
+        return len(data)
+
+    def _available(self):
+        now = time.monotonic()
+        return sum(len(b) for t, b in self._rx if t <= now)
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return self._available()
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        out = bytearray()
+        with self._cond:
+            while len(out) < size and self.is_open:
+                now = time.monotonic()
+                if self._rx and self._rx[0][0] <= now:
+                    chunk = self._rx[0][1]
+                    take = chunk[:size - len(out)]
+                    out += take
+                    del chunk[:len(take)]
+                    if not chunk:
+                        self._rx.popleft()
+                    continue
+                if deadline is not None and now >= deadline:
+                    break
+                wake = self._rx[0][0] if self._rx else None
+                if deadline is not None:
+                    wake = deadline if wake is None else min(wake, deadline)
+                self._cond.wait(None if wake is None else max(0.0, wake - now))
+        return bytes(out)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._rx.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+def open_serial(port, baud=115200, timeout=1):
+    """ Open a serial port, or an in-process emulator when port is
+    "emulator" (uart_axi) or "emulator:<design>".
+
+    Arguments:
+    port -- Device path or emulator name
+    baud -- Baud rate; the emulator paces its responses at it
+    timeout -- Read timeout in seconds
+    """
+    if(port == "emulator" or port.startswith("emulator:")):
+        design = port.partition(":")[2] or "uart_axi"
+        assert design in MODELS, f"Unknown design {design}, expected one of {sorted(MODELS)}"
+        return EmulatedSerial(MODELS[design](), baud=baud, timeout=timeout)
+
+    import serial
+    return serial.Serial(
+        port=port,
+        baudrate=baud,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.EIGHTBITS,
+        timeout=timeout
+    )
+
+def serve_pty(model, baud=None, link=None):
+    """ Serve a model on a new pseudo terminal until interrupted.
+
+    Arguments:
+    model -- UartAxiModel or UartAxisModel
+    baud -- If set, pace responses at this line rate
+    link -- Optional path of a symlink to the pty
+    """
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if(link is not None):
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(path, link)
+
+    print(f"Emulating {type(model).__name__} on {path}" + (f" ({link})" if link else ""), flush=True)
+
+    pacer = LinePacer(baud) if baud else None
+    leds = model.leds
+    hung = False
+    try:
+        while True:
+            data = os.read(master, 4096)
+            resp = model.receive(data)
+            if(pacer is not None):
+                pacer.received(len(data))
+                delay = pacer.sent(len(resp)) - time.monotonic()
+                if(delay > 0):
+                    time.sleep(delay)
+            if(resp):
+                os.write(master, resp)
+            if(model.leds != leds):
+                leds = model.leds
+                print(f"LEDs: 0b{leds:05b}", flush=True)
+            if(getattr(model, "hung", False) and not hung):
+                hung = True
+                print("Bridge hung: access outside RAM/GPIO/STS", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if(link is not None and os.path.islink(link)):
+            os.remove(link)
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the FPGA designs on a pseudo terminal.")
+    parser.add_argument("--design", choices=sorted(MODELS), default="uart_axi", help="Design to emulate (default: uart_axi)")
+    parser.add_argument("--baud", type=int, default=None, help="Pace responses at this baud rate (default: no pacing)")
+    parser.add_argument("--buttons", type=lambda s: int(s, 0), default=0, help="buttons_i value for uart_axi (default: 0)")
+    parser.add_argument("--link", default=None, help="Also make a symlink to the pty at this path")
+    args = parser.parse_args()
+
+    model = MODELS[args.design]()
+    if(args.design == "uart_axi"):
+        model.buttons = args.buttons
+    serve_pty(model, args.baud, args.link)
+
+if __name__ == "__main__":
+    main()
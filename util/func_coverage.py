@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Functional coverage for the cocotb testbenches.
+
+A CoverGroup holds CoverPoints (and CoverCrosses of two points), each a
+fixed list of bins with their hit counts in an array, so a sample is a
+single array increment; collectors (e.g. dbg_monitor.DbgBridgeCoverage)
+compute the bin index from signal values they already read.
+
+Coverage is only collected when enabled (pytest --func-coverage, or
+SIM_COVERAGE=1). Every simulator process then writes its database to
+func_coverage.json in its work directory when it exits, so parallel and
+parametrized runs (util/regress.py, test_each) each leave one file.
+Those are merged by bin name into one report:
+
+Usage:
+    python3 util/func_coverage.py report [PATH ...] [-o MERGED] [--holes] [--fail-under PERCENT]
+
+PATH is a database or a directory searched for them (default: the
+repository). --holes lists the uncovered bins, so regression time can
+go to tests that hit them.
+
+Coverage also steers the random tests: a Saturation ends a test once
+its stimulus stops hitting new bins, and rank() orders the runs of a
+regression (e.g. util/regress.py --seeds) by the bins they add, so the
+seeds that add none can be skipped next time (regress.py --select).
+"""
+
+import os
+import sys
+import json
+import array
+import atexit
+import argparse
+
+FILENAME = "func_coverage.json"
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def enabled():
+    """ True if coverage collection was requested (--func-coverage or
+    SIM_COVERAGE). """
+    return os.environ.get("SIM_COVERAGE", "").lower() in ("1", "true", "yes")
+
+class CoverPoint:
+    """Bins of one sampled value, with their hit counts.
+
+    name -- Point name, unique within its group
+    bins -- List of bin names; sample() takes an index into it
+    """
+
+    def __init__(self, name, bins):
+        self.name = name
+        self.bins = list(bins)
+        self.hits = array.array("Q", bytes(8 * len(self.bins)))
+        self._index = {b: i for i, b in enumerate(self.bins)}
+
+    def sample(self, i):
+        """ Count a hit of bin i. """
+        self.hits[i] += 1
+
+    def sample_bin(self, name):
+        """ Count a hit of the bin called name. """
+        self.hits[self._index[name]] += 1
+
+    def index(self, name):
+        return self._index[name]
+
+class CoverCross(CoverPoint):
+    """Every combination of the bins of two points, named "a/b".
+
+    name -- Cross name, unique within its group
+    a -- First CoverPoint
+    b -- Second CoverPoint
+    """
+
+    def __init__(self, name, a, b):
+        super().__init__(name, [f"{x}/{y}" for x in a.bins for y in b.bins])
+        self.width = len(b.bins)
+
+    def sample(self, i, j):
+        """ Count a hit of bin i of the first point with bin j of the
+        second. """
+        self.hits[i * self.width + j] += 1
+
+class CoverGroup:
+    """Named set of cover points. Use group() to get one, so that every
+    test in a simulator process adds to the same counts.
+
+    name -- Group name
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.points = {}
+
+    def point(self, name, bins):
+        """ Get the point called name, creating it with bins. """
+        if(name not in self.points):
+            self.points[name] = CoverPoint(name, bins)
+        return self.points[name]
+
+    def cross(self, name, a, b):
+        """ Get the cross of points a and b called name. """
+        if(name not in self.points):
+            self.points[name] = CoverCross(name, a, b)
+        return self.points[name]
+
+_groups = {}
+
+def group(name):
+    """ Get the cover group called name, creating it (and arranging for
+    the database to be written at exit) on first use.
+
+    Arguments:
+    name -- Group name
+    """
+    if(not _groups):
+        atexit.register(write)
+    if(name not in _groups):
+        _groups[name] = CoverGroup(name)
+    return _groups[name]
+
+def database():
+    """ Get the coverage collected by this process as a database. """
+    meta = {k.lower(): os.environ[k] for k in ("TOPLEVEL", "MODULE", "TESTCASE") if os.environ.get(k)}
+    meta["path"] = os.getcwd()
+    return {"runs": [meta],
+            "groups": {g.name: {p.name: {"bins": p.bins, "hits": list(p.hits)} for p in g.points.values()}
+                       for g in _groups.values()}}
+
+def write(path=None):
+    """ Write the database to path (default $SIM_COVERAGE_FILE, else
+    func_coverage.json in the current directory, i.e. the simulator's
+    work directory). Returns the path, or None if nothing was
+    collected.
+
+    Arguments:
+    path -- Output file
+    """
+    if(not _groups):
+        return None
+    path = path or os.environ.get("SIM_COVERAGE_FILE") or os.path.abspath(FILENAME)
+    with open(path, "w") as fd:
+        json.dump(database(), fd)
+    return path
+
+def covered_bins(names=None):
+    """ Count the bins hit so far in this process.
+
+    Arguments:
+    names -- Group names to count (default: all)
+    """
+    return sum(1 for g in _groups.values() if names is None or g.name in names
+               for p in g.points.values() for h in p.hits if h)
+
+class Saturation:
+    """Tells a random test when more stimulus stops adding coverage, so
+    it can stop early: once no new bin has been hit for patience
+    samples, or once target bins are covered.
+
+    Call it once per stimulus item (request, word, ...); it only counts
+    bins every interval calls. If coverage is not enabled it never
+    stops the test.
+
+    names -- Cover groups to watch (default: all)
+    patience -- Calls without a new bin before stopping (default 200;
+                $SIM_COVERAGE_PATIENCE overrides it)
+    target -- Stop once this many bins are covered
+    interval -- Count bins every this many calls
+    """
+
+    def __init__(self, names=None, patience=None, target=None, interval=10):
+        self.names = names
+        self.patience = int(os.environ.get("SIM_COVERAGE_PATIENCE") or patience or 200)
+        self.target = target
+        self.interval = interval
+        self.calls = 0
+        self.covered = covered_bins(names)
+        self._last_new = 0
+
+    def __call__(self):
+        if(not enabled()):
+            return False
+        self.calls += 1
+        if(self.calls % self.interval):
+            return False
+        covered = covered_bins(self.names)
+        if(covered > self.covered):
+            self.covered = covered
+            self._last_new = self.calls
+        if(self.target is not None and covered >= self.target):
+            return True
+        return self.calls - self._last_new >= self.patience
+
+def bin_set(db):
+    """ Get the set of (group, point, bin) hit in a database. """
+    return {(g, p, b) for g, points in db["groups"].items() for p, point in points.items()
+            for b, h in zip(point["bins"], point["hits"]) if h}
+
+def rank(runs):
+    """ Rank runs (e.g. seeds of a test) by the coverage they add:
+    repeatedly pick the run that hits the most bins no run picked so
+    far hits, preferring shorter runs on a tie, until none adds any.
+    Returns (selected, redundant): selected is a list of (key, new
+    bins) in pick order, redundant the keys of runs that add nothing.
+
+    Arguments:
+    runs -- Dict of key -> (database, wall time)
+    """
+    sets = {k: bin_set(db) for k, (db, t) in runs.items()}
+    covered = set()
+    selected = []
+    left = set(runs)
+    while left:
+        best = max(left, key=lambda k: (len(sets[k] - covered), -runs[k][1]))
+        new = len(sets[best] - covered)
+        if(not new):
+            break
+        selected.append((best, new))
+        covered |= sets[best]
+        left.remove(best)
+    return selected, sorted(left)
+
+def find(paths):
+    """ Find the databases in paths (files, or directories searched
+    recursively).
+
+    Arguments:
+    paths -- List of paths
+    """
+    files = []
+    for p in paths:
+        if(os.path.isdir(p)):
+            for d, subdirs, names in os.walk(p):
+                subdirs[:] = sorted(s for s in subdirs if s not in (".git", "__pycache__"))
+                files += [os.path.join(d, n) for n in names if n == FILENAME]
+        else:
+            files.append(p)
+    return sorted(files)
+
+def merge(dbs):
+    """ Merge databases by group, point and bin name. Bins missing from
+    some databases (e.g. from an older testbench) are kept.
+
+    Arguments:
+    dbs -- Iterable of databases
+    """
+    merged = {"runs": [], "groups": {}}
+    for db in dbs:
+        merged["runs"] += db["runs"]
+        for gname, points in db["groups"].items():
+            mg = merged["groups"].setdefault(gname, {})
+            for pname, p in points.items():
+                mp = mg.setdefault(pname, {"bins": [], "hits": []})
+                index = {b: i for i, b in enumerate(mp["bins"])}
+                for b, h in zip(p["bins"], p["hits"]):
+                    if(b not in index):
+                        index[b] = len(mp["bins"])
+                        mp["bins"].append(b)
+                        mp["hits"].append(0)
+                    mp["hits"][index[b]] += h
+    return merged
+
+def load(paths):
+    """ Load and merge every database in paths. """
+    dbs = []
+    for f in find(paths):
+        with open(f) as fd:
+            dbs.append(json.load(fd))
+    return merge(dbs)
+
+def report(db, holes=False):
+    """ Print the coverage of every point of a database. Returns
+    (covered bins, total bins).
+
+    Arguments:
+    db -- Database
+    holes -- Also list the uncovered bins
+    """
+    covered = total = 0
+    for gname, points in sorted(db["groups"].items()):
+        for pname, p in points.items():
+            n = sum(1 for h in p["hits"] if h)
+            covered += n
+            total += len(p["bins"])
+            print(f"{gname}.{pname}: {n}/{len(p['bins'])} ({n / len(p['bins']):.0%})")
+            if(holes):
+                for b, h in zip(p["bins"], p["hits"]):
+                    if(not h):
+                        print(f"    hole: {b}")
+    print(f"Total: {covered}/{total} bins ({covered / total if total else 0:.1%}) from {len(db['runs'])} runs")
+    return covered, total
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and report functional coverage.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rep = sub.add_parser("report", help="Merge databases and print the coverage")
+    rep.add_argument("paths", nargs="*", default=[REPO_ROOT], help="Databases or directories to search (default: the repository)")
+    rep.add_argument("-o", "--output", default=None, help="Also write the merged database here")
+    rep.add_argument("--holes", action="store_true", help="List the uncovered bins")
+    rep.add_argument("--fail-under", type=float, default=None, metavar="PERCENT", help="Exit 1 if total coverage is below this")
+    args = parser.parse_args()
+
+    db = load(args.paths)
+    covered, total = report(db, args.holes)
+    if(args.output is not None):
+        with open(args.output, "w") as fd:
+            json.dump(db, fd)
+    if(args.fail_under is not None and (not total or 100 * covered / total < args.fail_under)):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
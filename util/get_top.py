@@ -1,4 +1,3 @@
-import json
+from filelist import resolve
 
-with open("filelist.json") as filelist:
-    print(json.load(filelist)["top"])
+print(resolve(".").top)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Incremental regression support: a dependency index from each module
+directory to the files its tests depend on, and a cache of per-item
+results keyed on the hashes of those files.
+
+A module's inputs are its filelists (and any filelists they
+include), every source they name (including shared ones such as provided/dff.sv), its Python test
+files (test_*.py, bench_*.py, conftest.py) and the helpers in util/.
+util/regress.py --incremental skips every (simulator, test, params)
+item whose inputs, seed and SIM_* options are the same as when it last
+passed, and reruns the rest.
+
+Usage:
+    python3 util/incremental.py deps [dirs ...] [--changed FILE ...] [-o INDEX]
+
+lists the inputs of each module, or with --changed, the modules a
+change to those files affects.
+"""
+
+import os
+import json
+import glob
+import hashlib
+import argparse
+
+from filelist import resolve
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Options that change what a run does without changing its inputs:
+# where its outputs go, or how it is observed.
+IGNORED_ENV = {"SIM_COVERAGE_FILE", "SIM_BENCH_DIR", "SIM_PROFILE", "SIM_WAVES",
+               "SIM_WAVE_START", "SIM_WAVE_STOP", "SIM_WAVE_ON_FAIL", "SIM_WAVE_FAIL_WINDOW",
+               "SIM_CCACHE"}
+
+def module_inputs(moddir, root=REPO_ROOT):
+    """ Get the files the tests of a module depend on, relative to root.
+
+    Arguments:
+    moddir -- Module directory (with a filelist.json)
+    root -- Repository root; filelist entries are relative to it
+    """
+    # filelist.json, and any other filelists of the module's tests
+    # (e.g. filelist_fastpath.json for a sim-only wrapper).
+    inputs = []
+    for path in sorted(glob.glob(os.path.join(moddir, "filelist*.json"))):
+        fl = resolve(moddir, os.path.basename(path), root)
+        inputs += [f for f in [os.path.relpath(d, root) for d in fl.depends] + fl.files if f not in inputs]
+
+    python = [os.path.join(moddir, n) for n in ("conftest.py",)]
+    python += glob.glob(os.path.join(moddir, "test_*.py")) + glob.glob(os.path.join(moddir, "bench_*.py"))
+    python += glob.glob(os.path.join(root, "util", "*.py"))
+
+    inputs += sorted(os.path.relpath(p, root) for p in python if os.path.exists(p))
+    return inputs
+
+def dependency_index(dirs, root=REPO_ROOT):
+    """ Get the dependency index of module directories: module (relative
+    to root) -> list of input files.
+
+    Arguments:
+    dirs -- Module directories
+    root -- Repository root
+    """
+    return {os.path.relpath(d, root): module_inputs(d, root) for d in dirs}
+
+def affected(index, changed, root=REPO_ROOT):
+    """ Get the modules of index that depend on any of the changed
+    files.
+
+    Arguments:
+    index -- Dependency index from dependency_index
+    changed -- Changed file paths (absolute, or relative to the
+               current directory)
+    root -- Repository root
+    """
+    changed = {os.path.relpath(os.path.realpath(p), root) for p in changed}
+    return sorted(m for m, inputs in index.items() if changed & set(inputs))
+
+class InputHasher:
+    """Hashes module inputs, each file at most once, so that sources
+    shared between modules are only read once per regression.
+
+    root -- Repository root
+    """
+
+    def __init__(self, root=REPO_ROOT):
+        self.root = root
+        self._files = {}
+
+    def file(self, path):
+        """ Get the sha256 of a file relative to root ("missing" if it
+        does not exist). """
+        if(path not in self._files):
+            full = os.path.join(self.root, path)
+            if(not os.path.exists(full)):
+                self._files[path] = "missing"
+            else:
+                h = hashlib.sha256()
+                with open(full, "rb") as fd:
+                    for chunk in iter(lambda: fd.read(1 << 16), b""):
+                        h.update(chunk)
+                self._files[path] = h.hexdigest()
+        return self._files[path]
+
+    def item(self, inputs, nodeid, seed=None, env=None):
+        """ Get the key of one pytest item: a sha256 over its inputs,
+        its node id (simulator, test and parameters), its seed and the
+        SIM_* options that affect the run.
+
+        Arguments:
+        inputs -- The module's input files (see module_inputs)
+        nodeid -- pytest node id
+        seed -- RANDOM_SEED, or None
+        env -- Environment to take the options from (default os.environ)
+        """
+        env = os.environ if env is None else env
+        h = hashlib.sha256()
+        for path in inputs:
+            h.update(f"{path}={self.file(path)}\n".encode())
+        h.update(f"nodeid={nodeid}\nseed={seed}\n".encode())
+        for k in sorted(env):
+            if(k.startswith("SIM_") and k not in IGNORED_ENV):
+                h.update(f"{k}={env[k]}\n".encode())
+        return h.hexdigest()
+
+class ResultCache:
+    """Results of the items that passed, keyed on their item key, in a
+    JSON file. Failed items are never cached, so they always rerun.
+
+    path -- Cache file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if(os.path.exists(path)):
+            with open(path) as fd:
+                self.entries = json.load(fd)
+
+    def lookup(self, name, key):
+        """ Get the cached result of the item called name if it passed
+        with the same key and its JUnit report is still there, else
+        None. """
+        entry = self.entries.get(name)
+        if(entry is None or entry["key"] != key or not os.path.exists(entry["result"]["junit"])):
+            return None
+        return entry["result"]
+
+    def store(self, name, key, result):
+        """ Record the result of a run; only passes are kept. """
+        if(result["passed"]):
+            self.entries[name] = {"key": key, "result": result}
+        else:
+            self.entries.pop(name, None)
+
+    def save(self):
+        with open(self.path, "w") as fd:
+            json.dump(self.entries, fd, indent=1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the dependency index of the module directories.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    deps = sub.add_parser("deps", help="List the inputs of each module, or the modules affected by changed files")
+    deps.add_argument("dirs", nargs="*", help="Module directories (default: all under the repository root)")
+    deps.add_argument("--changed", nargs="+", default=None, metavar="FILE", help="Only list the modules these files affect")
+    deps.add_argument("-o", "--output", default=None, help="Also write the index here")
+    args = parser.parse_args()
+
+    # Only imported here: regress imports this module.
+    from regress import find_module_dirs
+
+    dirs = [os.path.realpath(d) for d in args.dirs] or find_module_dirs(REPO_ROOT)
+    index = dependency_index(dirs)
+    if(args.output is not None):
+        with open(args.output, "w") as fd:
+            json.dump(index, fd, indent=1)
+
+    if(args.changed is not None):
+        for m in affected(index, args.changed):
+            print(m)
+        return
+    for m, inputs in index.items():
+        print(m + ":")
+        for p in inputs:
+            print("    " + p)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Command line options shared by every module's pytest run. Each
+# module's conftest.py imports these hooks. The options are passed on
+# to utilities.runner (and to the simulator process) through
+# environment variables, so setting the variables directly works too.
+
+import os
+
+# option name -> environment variable
+_ENV_OPTIONS = {
+    "waves": "SIM_WAVES",
+    "wave_start": "SIM_WAVE_START",
+    "wave_stop": "SIM_WAVE_STOP",
+    "wave_on_fail": "SIM_WAVE_ON_FAIL",
+    "wave_fail_window": "SIM_WAVE_FAIL_WINDOW",
+    "uart_speed": "SIM_UART_SPEED",
+    "bench": "SIM_BENCH",
+    "bench_dir": "SIM_BENCH_DIR",
+    "profile": "SIM_PROFILE",
+    "traffic_count": "SIM_TRAFFIC_COUNT",
+    "traffic_sim_ms": "SIM_TRAFFIC_SIM_MS",
+    "traffic_wall_s": "SIM_TRAFFIC_WALL_S",
+    "func_coverage": "SIM_COVERAGE",
+    "cov_patience": "SIM_COVERAGE_PATIENCE",
+    "snapshot": "SIM_SNAPSHOT",
+    "build_profile": "SIM_BUILD_PROFILE",
+    "verilator_threads": "SIM_VERILATOR_THREADS",
+    "ccache": "SIM_CCACHE",
+}
+
+def pytest_addoption(parser):
+    group = parser.getgroup("sim", "simulation")
+
+    # Every module's conftest.py registers these hooks; only add the
+    # options once when pytest is run on several modules together.
+    if any(o.dest == "waves" for o in group.options):
+        return
+
+    group.addoption("--waves", choices=["none", "fst", "vcd"], default=None,
+                    help="Dump waves in this format (default: none, or $SIM_WAVES)")
+    group.addoption("--wave-start", type=float, default=None, metavar="NS",
+                    help="Start the wave dump at this simulation time")
+    group.addoption("--wave-stop", type=float, default=None, metavar="NS",
+                    help="Stop the wave dump at this simulation time (Icarus only)")
+    group.addoption("--wave-on-fail", choices=["none", "fst", "vcd"], default=None,
+                    help="Re-run failing tests with waves in this format (default: fst)")
+    group.addoption("--wave-fail-window", type=float, default=None, metavar="NS",
+                    help="Only dump this long before the failure when re-running")
+    group.addoption("--uart-speed", choices=["fast", "real"], default=None,
+                    help="Run the UARTs with the sim-only fast baud rate or the real one (default: fast)")
+    group.addoption("--bench", action="store_const", const="1", default=None,
+                    help="Also run the throughput/latency benchmarks (test_bench)")
+    group.addoption("--bench-dir", default=None, metavar="DIR",
+                    help="Write benchmark results here (default: run/bench in each module)")
+    group.addoption("--profile", choices=["none", "cprofile", "py-spy"], default=None,
+                    help="Profile the cocotb Python side of each run (report: run/<test>/<params>/<sim>.timing.json)")
+    group.addoption("--traffic-count", type=int, default=None, metavar="N",
+                    help="Requests per constrained-random traffic test")
+    group.addoption("--traffic-sim-ms", type=float, default=None, metavar="MS",
+                    help="Run the traffic tests for this much simulated time instead")
+    group.addoption("--traffic-wall-s", type=float, default=None, metavar="S",
+                    help="Run the traffic tests for this much wall-clock time instead")
+    group.addoption("--func-coverage", action="store_const", const="1", default=None,
+                    help="Collect functional coverage (func_coverage.json in each work directory)")
+    group.addoption("--cov-patience", type=int, default=None, metavar="N",
+                    help="With --func-coverage, stop random tests after N stimulus items without a new bin (default: 200)")
+    group.addoption("--snapshot", action="store_const", const="1", default=None,
+                    help="Restore the post-reset state of the first test instead of repeating the bring-up (test_all runs)")
+    group.addoption("--build-profile", choices=["debug", "default", "fast", "max-throughput", "auto"], default=None,
+                    help="Verilator build profile, or auto to pick the fastest per design (default: default)")
+    group.addoption("--verilator-threads", type=int, default=None, metavar="N",
+                    help="Model threads for the max-throughput profile (default: up to 4)")
+    group.addoption("--no-ccache", dest="ccache", action="store_const", const="0", default=None,
+                    help="Don't share compiled Verilator objects between builds through ccache")
+
+def pytest_configure(config):
+    for option, env in _ENV_OPTIONS.items():
+        value = config.getoption(option)
+        if(value is not None):
+            os.environ[env] = str(value)
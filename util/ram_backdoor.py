@@ -0,0 +1,151 @@
+# Backdoor access to a simulated memory array, e.g. the mem array of
+# axi_ram in uart_axi (dut.u_axi_ram.mem). Loads and dumps go straight
+# through the simulator's handles to the array, so filling or checking
+# the whole 4 KB RAM takes no simulated time at all, instead of
+# thousands of UART frames.
+#
+# Writes take effect immediately. Don't load the words an AXI
+# transaction is using at the same moment; between transactions, or
+# before reset, is fine. Not at time zero: axi_ram clears the array in
+# an initial block, which can run after the test has started.
+#
+# Images are raw binary (.bin) or $readmemh text (.hex/.mem: one word
+# per line, optional @address lines, // comments).
+
+import os
+
+from dbg_codec import as_bytes, decode_words, encode_words
+
+# The arrays are of 32-bit words, like the AXI data bus.
+WORD_BYTES = 4
+
+class RamBackdoor:
+    """Byte-addressed backdoor to a memory array of little-endian 32-bit
+    words.
+
+    mem -- cocotb handle of the array (e.g. dut.u_axi_ram.mem)
+    base -- Bus address of word 0
+    """
+
+    def __init__(self, mem, base=0):
+        self.mem = mem
+        self.base = base
+        self.word_bytes = WORD_BYTES
+        self.words = len(mem)
+        self.size = self.words * WORD_BYTES
+
+    def _span(self, addr, length):
+        offset = addr - self.base
+        assert 0 <= offset and offset + length <= self.size, \
+            f"0x{addr:08x}+{length} is outside the memory (0x{self.base:08x}+{self.size})"
+        first = offset // self.word_bytes
+        last = (offset + length + self.word_bytes - 1) // self.word_bytes
+        return offset - first * self.word_bytes, first, last
+
+    def read_words(self, first, count):
+        """ Read count words starting at word index first. """
+        return [int(self.mem[i].value) for i in range(first, first + count)]
+
+    def write_words(self, first, words):
+        """ Write words starting at word index first. """
+        for i, w in enumerate(words):
+            self.mem[first + i].setimmediatevalue(int(w))
+
+    def load(self, data, addr=None):
+        """ Write data (bytes, bytearray, NumPy array, list of ints)
+        starting at addr (default base). Partial words at either end
+        keep their other bytes.
+
+        Arguments:
+        data -- Bytes to write
+        addr -- Start address
+        """
+        addr = self.base if addr is None else addr
+        data = as_bytes(data)
+        skip, first, last = self._span(addr, len(data))
+        if(not data):
+            return
+        if(skip or (skip + len(data)) % self.word_bytes):
+            buf = bytearray(encode_words(self.read_words(first, last - first)))
+            buf[skip:skip + len(data)] = data
+            data = buf
+        self.write_words(first, decode_words(bytes(data)))
+
+    def dump(self, addr=None, length=None):
+        """ Read length bytes (default: to the end of the memory)
+        starting at addr (default base). Returns a bytearray.
+
+        Arguments:
+        addr -- Start address
+        length -- Number of bytes
+        """
+        addr = self.base if addr is None else addr
+        length = self.base + self.size - addr if length is None else length
+        skip, first, last = self._span(addr, length)
+        data = encode_words(self.read_words(first, last - first))
+        return bytearray(data[skip:skip + length])
+
+    def dump_words(self):
+        """ Read the whole memory as words: a NumPy uint32 array if NumPy
+        is installed, else a list of ints. """
+        return decode_words(self.dump())
+
+    def fill(self, value=0):
+        """ Set every word to value. """
+        self.write_words(0, [value] * self.words)
+
+    def load_file(self, path, addr=None):
+        """ Load a .bin image, or a $readmemh text image (any other
+        extension). Returns the number of bytes loaded.
+
+        Arguments:
+        path -- Image file
+        addr -- Start address of the image (default base)
+        """
+        addr = self.base if addr is None else addr
+        if(os.path.splitext(path)[1] == ".bin"):
+            with open(path, "rb") as fd:
+                data = fd.read()
+            self.load(data, addr)
+            return len(data)
+
+        first = (addr - self.base) // self.word_bytes
+        count = 0
+        for index, word in read_hex(path):
+            self.write_words(first + index, [word])
+            count += self.word_bytes
+        return count
+
+    def save_file(self, path, addr=None, length=None):
+        """ Dump to a .bin image, or a $readmemh text image (any other
+        extension).
+
+        Arguments:
+        path -- Image file
+        addr -- Start address (default base)
+        length -- Number of bytes (default: to the end of the memory)
+        """
+        data = self.dump(addr, length)
+        if(os.path.splitext(path)[1] == ".bin"):
+            with open(path, "wb") as fd:
+                fd.write(data)
+            return
+        with open(path, "w") as fd:
+            for w in decode_words(bytes(data) + bytes(-len(data) % self.word_bytes)):
+                fd.write(f"{int(w):08x}\n")
+
+def read_hex(path):
+    """ Parse a $readmemh image. Yields (word index, word).
+
+    Arguments:
+    path -- Image file
+    """
+    index = 0
+    with open(path) as fd:
+        for line in fd:
+            for token in line.split("//")[0].split():
+                if(token.startswith("@")):
+                    index = int(token[1:], 16)
+                    continue
+                yield index, int(token.replace("_", ""), 16)
+                index += 1
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Parallel regression driver.
+
+Discovers every module directory (any directory with a filelist.json
+and test_*.py files), collects its pytest items - the (simulator x
+test x parameter) matrix of test_all/test_each - and runs them across
+a pool of workers, one pytest process per item. Models are compiled
+once per (simulator, parameter set): utilities.build() holds a file
+lock on the shared build cache directory, so workers that need the
+same model wait for it instead of compiling it again.
+
+The per-item JUnit results are merged into one report. With
+--func-coverage, the functional coverage of every item is merged too
+(see util/func_coverage.py), and the runs are ranked by the coverage
+they add: OUTDIR/selection.json lists the runs (item and seed) that
+add coverage and those that add none. A later regression with
+--select selection.json only runs the former, so the same coverage
+costs less simulation time. Items the selection does not know about
+(new tests) always run.
+
+With --incremental, items are skipped if they passed before with the
+same inputs (see util/incremental.py: the module's filelist and
+sources, including shared provided/ files, its test files and util/),
+seed and SIM_* options. Their earlier results, kept in
+OUTDIR/incremental.json, still go into the merged report.
+
+Usage:
+    python3 util/regress.py [-j JOBS] [-k EXPRESSION] [-o OUTDIR] [--func-coverage]
+                            [--seeds N] [--select FILE] [--incremental] [dirs ...]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+import xml.etree.ElementTree as ET
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import func_coverage
+import incremental
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Directories that never contain module sources.
+SKIP_DIRS = {".git", "run", "build", "lint", "regress", "__pycache__", ".pytest_cache"}
+
+def find_module_dirs(root):
+    """ Find every module directory under root, i.e. every directory
+    with a filelist.json and at least one test_*.py.
+
+    Arguments:
+    root -- Directory to search
+    """
+    dirs = []
+    for path, subdirs, files in os.walk(root):
+        subdirs[:] = sorted(d for d in subdirs if d not in SKIP_DIRS)
+        if "filelist.json" in files and any(f.startswith("test_") and f.endswith(".py") for f in files):
+            dirs.append(path)
+    return dirs
+
+def collect(moddir, expression=None):
+    """ Get the pytest node ids of every item in moddir, or None (after
+    printing pytest's output) if the module could not be collected.
+
+    Arguments:
+    moddir -- Module directory
+    expression -- Optional pytest -k expression
+    """
+    cmd = [sys.executable, "-m", "pytest", "--collect-only", "-q", "-p", "no:cacheprovider"]
+    if(expression is not None):
+        cmd += ["-k", expression]
+    out = subprocess.run(cmd, cwd=moddir, capture_output=True, text=True)
+    # 5: nothing collected, e.g. nothing matched -k.
+    if(out.returncode not in (0, 5)):
+        print(f"Collecting {os.path.relpath(moddir, REPO_ROOT)} failed (pytest exit code {out.returncode}):")
+        print(out.stdout + out.stderr)
+        return None
+    return [l.strip() for l in out.stdout.splitlines() if "::" in l]
+
+def schedule(jobs):
+    """ Order jobs so that consecutive jobs use different models. The
+    first wave of workers then compiles distinct models in parallel
+    instead of queueing on the same build lock.
+
+    Arguments:
+    jobs -- List of (moddir, nodeid, seed) tuples
+    """
+    groups = {}
+    for job in jobs:
+        moddir, nodeid = job[:2]
+        # conftest's pytest_make_parametrize_id names the parameters:
+        # test_each[simulator=verilator-test_name=reset_test-example_p=1]
+        sim = re.search(r"simulator=([^\]-]+)", nodeid)
+        groups.setdefault((moddir, sim.group(1) if sim else ""), []).append(job)
+
+    ordered = []
+    queues = list(groups.values())
+    while queues:
+        for q in queues:
+            ordered.append(q.pop(0))
+        queues = [q for q in queues if q]
+    return ordered
+
+def job_name(moddir, nodeid, seed=None):
+    """ Get a file system safe name for a job. """
+    name = os.path.relpath(moddir, REPO_ROOT) + "::" + nodeid
+    if(seed is not None):
+        name += f"_seed{seed}"
+    return re.sub(r"[^A-Za-z0-9_.=-]+", "_", name)
+
+def run_job(moddir, nodeid, outdir, seed=None, coverage=False):
+    """ Run one pytest item in its own process. Returns a dict with
+    the outcome, wall time and the paths of the log, JUnit file and
+    coverage database.
+
+    Arguments:
+    moddir -- Module directory
+    nodeid -- pytest node id, relative to moddir
+    outdir -- Directory for logs and JUnit files
+    seed -- RANDOM_SEED for cocotb, or None for a random one
+    coverage -- Collect functional coverage into outdir
+    """
+    name = job_name(moddir, nodeid, seed)
+    log = os.path.join(outdir, name + ".log")
+    junit = os.path.join(outdir, name + ".xml")
+    cov = os.path.join(outdir, name + ".cov.json")
+
+    cmd = [sys.executable, "-m", "pytest", "-q", "-rA", "-p", "no:cacheprovider",
+           "--junitxml", junit, nodeid]
+
+    env = dict(os.environ)
+    if(seed is not None):
+        env["RANDOM_SEED"] = str(seed)
+    if(coverage):
+        env["SIM_COVERAGE"] = "1"
+        env["SIM_COVERAGE_FILE"] = cov
+        if(os.path.exists(cov)):
+            os.remove(cov)
+
+    start = time.time()
+    with open(log, "w") as fd:
+        rc = subprocess.run(cmd, cwd=moddir, env=env, stdout=fd, stderr=subprocess.STDOUT).returncode
+
+    return {"module": os.path.relpath(moddir, REPO_ROOT),
+            "nodeid": nodeid,
+            "seed": seed,
+            "passed": rc == 0,
+            "time": time.time() - start,
+            "log": log,
+            "junit": junit,
+            "coverage": cov if coverage and os.path.exists(cov) else None}
+
+def plan(moddir, nodeid, seeds, selection):
+    """ Get the seeds to run an item with. Items that a previous
+    regression ranked (see write_selection) only run the seeds that
+    added coverage; other items run every seed.
+
+    Arguments:
+    moddir -- Module directory
+    nodeid -- pytest node id
+    seeds -- Seeds for unranked items ([None] for one random seed)
+    selection -- Loaded selection file, or None
+    """
+    key = (os.path.relpath(moddir, REPO_ROOT), nodeid)
+    if(selection is None or key not in selection["items"]):
+        return seeds
+    return [r["seed"] for r in selection["selected"] if (r["module"], r["nodeid"]) == key]
+
+def write_selection(results, path):
+    """ Rank the runs of a regression by the coverage they add (see
+    func_coverage.rank) and write the ranking to path, for --select.
+    Returns (selected, redundant) results.
+
+    Arguments:
+    results -- Job results with coverage databases
+    path -- Output file
+    """
+    runs = {}
+    for r in results:
+        if(r["coverage"] is not None and r["passed"]):
+            with open(r["coverage"]) as fd:
+                runs[job_name(os.path.join(REPO_ROOT, r["module"]), r["nodeid"], r["seed"])] = (json.load(fd), r["time"])
+    by_name = {job_name(os.path.join(REPO_ROOT, r["module"]), r["nodeid"], r["seed"]): r for r in results}
+
+    ranked, redundant = func_coverage.rank(runs)
+    entry = lambda r: {k: r[k] for k in ("module", "nodeid", "seed", "time")}
+    selected = [dict(entry(by_name[k]), new_bins=n) for k, n in ranked]
+    skipped = [entry(by_name[k]) for k in redundant]
+    with open(path, "w") as fd:
+        json.dump({"selected": selected, "redundant": skipped}, fd, indent=1)
+    return selected, skipped
+
+def load_selection(path):
+    """ Load a file written by write_selection. """
+    with open(path) as fd:
+        selection = json.load(fd)
+    selection["items"] = {(r["module"], r["nodeid"]) for r in selection["selected"] + selection["redundant"]}
+    return selection
+
+def merge_junit(results, path):
+    """ Merge the JUnit files of all jobs into a single test suite.
+
+    Arguments:
+    results -- List of job results from run_job
+    path -- Path of the merged JUnit file
+    """
+    suite = ET.Element("testsuite", name="regress")
+    counts = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+
+    for r in results:
+        if(not os.path.exists(r["junit"])):
+            # pytest died before writing its report; record an error.
+            tc = ET.SubElement(suite, "testcase", classname=r["module"], name=r["nodeid"], time="{:.3f}".format(r["time"]))
+            ET.SubElement(tc, "error", message="no JUnit report, see " + r["log"])
+            counts["tests"] += 1
+            counts["errors"] += 1
+            continue
+
+        for tc in ET.parse(r["junit"]).getroot().iter("testcase"):
+            tc.set("classname", r["module"] + "." + tc.get("classname", ""))
+            suite.append(tc)
+            counts["tests"] += 1
+            for k, tag in (("failures", "failure"), ("errors", "error"), ("skipped", "skipped")):
+                if tc.find(tag) is not None:
+                    counts[k] += 1
+
+    for k, v in counts.items():
+        suite.set(k, str(v))
+    suite.set("time", "{:.3f}".format(sum(r["time"] for r in results)))
+
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every module's simulation tests in parallel.")
+    parser.add_argument("dirs", nargs="*", help="Module directories (default: all under the repository root)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of parallel workers (default: number of cores)")
+    parser.add_argument("-k", dest="expression", default=None, help="Only run items matching this pytest -k expression")
+    parser.add_argument("-o", "--outdir", default=os.path.join(REPO_ROOT, "regress"), help="Directory for logs and the merged report")
+    parser.add_argument("--func-coverage", action="store_true", help="Collect functional coverage and merge it into OUTDIR/func_coverage_merged.json")
+    parser.add_argument("--seeds", type=int, default=None, metavar="N",
+                        help="Run every item with RANDOM_SEED 1..N (default: one random seed)")
+    parser.add_argument("--select", default=None, metavar="FILE",
+                        help="Only run the seeds a previous --func-coverage regression ranked as adding coverage (its selection.json)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Skip items that passed before and whose inputs have not changed since")
+    args = parser.parse_args()
+
+    if(args.func_coverage):
+        os.environ["SIM_COVERAGE"] = "1"
+
+    dirs = [os.path.realpath(d) for d in args.dirs] or find_module_dirs(REPO_ROOT)
+    os.makedirs(args.outdir, exist_ok=True)
+
+    seeds = list(range(1, args.seeds + 1)) if args.seeds else [None]
+    selection = load_selection(args.select) if args.select else None
+
+    jobs = []
+    skipped = 0
+    broken = []
+    for d in dirs:
+        items = collect(d, args.expression)
+        if(items is None):
+            broken.append(d)
+            continue
+        for n in items:
+            s = plan(d, n, seeds, selection)
+            jobs += [(d, n, seed) for seed in s]
+            skipped += not s
+    jobs = schedule(jobs)
+
+    results = []
+    if(args.incremental):
+        cache = incremental.ResultCache(os.path.join(args.outdir, "incremental.json"))
+        hasher = incremental.InputHasher()
+        index = incremental.dependency_index(dirs)
+        keys = {}
+        stale = []
+        for d, n, seed in jobs:
+            name = job_name(d, n, seed)
+            keys[name] = hasher.item(index[os.path.relpath(d, REPO_ROOT)], n, seed)
+            r = cache.lookup(name, keys[name])
+            if(r is not None):
+                results.append(dict(r, cached=True))
+            else:
+                stale.append((d, n, seed))
+        print(f"{len(results)} items unchanged since they last passed")
+        jobs = stale
+
+    print(f"Running {len(jobs)} items from {len(dirs)} modules on {args.jobs} workers"
+          + (f" ({skipped} items skipped: no coverage to add)" if skipped else ""))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_job, d, n, args.outdir, seed, args.func_coverage) for d, n, seed in jobs]
+        for f in as_completed(futures):
+            r = f.result()
+            results.append(r)
+            status = "PASSED" if r["passed"] else "FAILED"
+            seed = f" seed {r['seed']}" if r["seed"] is not None else ""
+            print(f"{status} {r['module']}::{r['nodeid']}{seed} ({r['time']:.1f}s)", flush=True)
+    wall = time.time() - start
+
+    if(args.incremental):
+        for r in results:
+            if(not r.get("cached")):
+                name = job_name(os.path.join(REPO_ROOT, r["module"]), r["nodeid"], r["seed"])
+                cache.store(name, keys[name], r)
+        cache.save()
+
+    results.sort(key=lambda r: (r["module"], r["nodeid"], r["seed"] or 0))
+    report = os.path.join(args.outdir, "results.xml")
+    counts = merge_junit(results, report)
+
+    failed = [r for r in results if not r["passed"]]
+    for r in failed:
+        print(f"  log: {r['log']}")
+
+    print(f"{counts['tests']} tests, {counts['failures']} failures, {counts['errors']} errors, "
+          f"{counts['skipped']} skipped in {wall:.1f}s wall "
+          f"({sum(r['time'] for r in results):.1f}s serial)")
+    print(f"Report: {report}")
+
+    if(args.func_coverage):
+        db = func_coverage.load([r["coverage"] for r in results if r["coverage"] is not None])
+        func_coverage.report(db)
+        merged = os.path.join(args.outdir, "func_coverage_merged.json")
+        with open(merged, "w") as fd:
+            json.dump(db, fd)
+        print(f"Coverage: {merged} (python3 util/func_coverage.py report {merged} --holes)")
+
+        path = os.path.join(args.outdir, "selection.json")
+        selected, redundant = write_selection(results, path)
+        print(f"{len(selected)} runs add coverage ({sum(r['time'] for r in selected):.1f}s), "
+              f"{len(redundant)} add none ({sum(r['time'] for r in redundant):.1f}s): {path}")
+
+    for d in broken:
+        print(f"Not run: {os.path.relpath(d, REPO_ROOT)} failed to collect")
+
+    sys.exit(1 if failed or broken else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Post-reset state snapshots. Every test starts with the same bring-up
+# (clock start, reset, a few hundred settling cycles). With snapshots
+# enabled (pytest --snapshot, or SIM_SNAPSHOT=1), the first test in a
+# simulator process runs it and captures the value of every register
+# in the design; later tests in the same process restore those values
+# instead of resetting and settling again.
+#
+# The simulators can't be checkpointed from cocotb (Verilator's
+# --savable needs its own C++ main loop, which cocotb owns), so the
+# snapshot is taken through the same handles the tests use: registers
+# only, since nets follow from them on the next evaluation. Memory
+# arrays are left alone, as reset leaves them alone too. cocotb runs
+# the tests of one module in one process, so this pays off in test_all
+# runs and not in test_each.
+
+import os
+
+from cocotb import simulator
+from cocotb.triggers import ReadOnly, NextTimeStep
+from cocotb.handle import HierarchyObject, HierarchyArrayObject, ModifiableObject
+
+def enabled():
+    """ True if snapshots were requested (--snapshot or SIM_SNAPSHOT). """
+    return os.environ.get("SIM_SNAPSHOT", "").lower() in ("1", "true", "yes")
+
+def registers(handle, exclude=()):
+    """ Get every register below a hierarchy handle.
+
+    Arguments:
+    handle -- cocotb handle (e.g. dut)
+    exclude -- Handles to leave out (e.g. the clock)
+    """
+    skip = {h._path for h in exclude}
+    regs = []
+    for child in handle:
+        if(child._path in skip):
+            continue
+        if(isinstance(child, (HierarchyObject, HierarchyArrayObject))):
+            regs += registers(child, exclude)
+        elif(isinstance(child, ModifiableObject) and child._handle.get_type() == simulator.REG):
+            regs.append(child)
+    return regs
+
+class StateSnapshot:
+    """Values of every register of a design at one point in time.
+
+    dut -- Top level handle
+    exclude -- Handles to leave out (e.g. the clock, which keeps running)
+    """
+
+    def __init__(self, dut, exclude=()):
+        self.values = [(r, r.value) for r in registers(dut, exclude)]
+
+    def restore(self):
+        """ Write the captured values back, immediately. """
+        for reg, value in self.values:
+            reg.setimmediatevalue(value)
+
+# key -> StateSnapshot, for the life of the simulator process
+_snapshots = {}
+
+async def bring_up(dut, key, sequence, exclude=()):
+    """ Run the bring-up sequence, or restore the state it left the
+    design in when a test of this process already ran it. Returns True
+    if the state was restored.
+
+    Arguments:
+    dut -- Top level handle
+    key -- Name of the bring-up (e.g. the clock and reset settings)
+    sequence -- async callable that brings the design up from scratch;
+                the snapshot is captured when it returns
+    exclude -- Handles to leave out of the snapshot
+    """
+    if(not enabled()):
+        await sequence()
+        return False
+    snap = _snapshots.get(key)
+    if(snap is None):
+        await sequence()
+        # Captured once every register has settled in this time step.
+        await ReadOnly()
+        _snapshots[key] = StateSnapshot(dut, exclude)
+        await NextTimeStep()
+        return False
+    snap.restore()
+    await NextTimeStep()
+    return True
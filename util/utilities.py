@@ -8,26 +8,87 @@
 #     ]
 # }
 
-# Each file in the filelist is relative to the repository root.
+# Each file in the filelist is relative to the repository root. A
+# filelist can also "include" other filelists; see util/filelist.py.
 
 import os
-import git
-
+import re
 import sys
 import json
+import time
+import fcntl
+import shutil
+import hashlib
+import contextlib
+import functools
+import subprocess
+import pstats
+import xml.etree.ElementTree as ET
 import cocotb
 
-from cocotb_test.simulator import run
 from cocotb.clock import Clock
 from cocotb.regression import TestFactory
 from cocotb.utils import get_sim_time
-from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, with_timeout
+from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, Edge, with_timeout
 from cocotb.types import LogicArray
 from cocotb.utils import get_sim_time
 
-def runner(simulator, timescale, tbpath, params, defs=[], testname=None, pymodule=None, jsonpath=None, jsonname="filelist.json", root=None):
+from filelist import resolve, repo_root
+
+# Wave dumping is off by default. SIM_WAVES (or --waves) selects
+# none, fst or vcd; the legacy WAVES=1 means fst.
+WAVE_MODES = ["none", "fst", "vcd"]
+
+# Profiling of the cocotb (Python) side of a run, selected by
+# SIM_PROFILE (or --profile): cProfile through cocotb's own
+# COCOTB_ENABLE_PROFILING, or py-spy sampling the simulator process.
+PROFILE_MODES = ["none", "cprofile", "py-spy"]
+
+# Verilator build profiles, selected by SIM_BUILD_PROFILE (or
+# --build-profile). Each one has extra verilator arguments, whether to
+# build with --timing (None: only if the sources need it, see
+# needs_timing), the number of model threads (0: get_threads()) and
+# whether to split the generated C++ and compile it with make -j.
+# default is the build this repository has always used. Icarus has no
+# profiles.
+BUILD_PROFILES = {
+    "debug": {"args": ["-O0", "--x-assign", "unique", "--x-initial", "unique"],
+              "timing": True, "threads": 1, "split": False},
+    "default": {"args": [], "timing": True, "threads": 1, "split": False},
+    "fast": {"args": ["-O3", "--x-assign", "fast", "--x-initial", "fast"],
+             "timing": None, "threads": 1, "split": True},
+    "max-throughput": {"args": ["-O3", "--x-assign", "fast", "--x-initial", "fast"],
+                       "timing": None, "threads": 0, "split": True},
+}
+
+# SIM_BUILD_PROFILE=auto tries each of these on a design in turn, then
+# keeps using whichever simulated fastest (see get_build_profile).
+AUTO_PROFILES = ["default", "fast", "max-throughput"]
+
+def runner(simulator, timescale, tbpath, params, defs=[], testname=None, pymodule=None, jsonpath=None, jsonname="filelist.json", root=None, cache=True,
+           waves=None, wave_start=None, wave_stop=None, wave_rerun=True, build_profile=None):
     """Run the simulator on test n, with parameters params, and defines
-    defs. If n is none, it will run all tests"""
+    defs. If n is none, it will run all tests. If cache is true, the
+    model is compiled once by build() and only launched here.
+
+    waves selects the dump format (none, fst or vcd) and wave_start /
+    wave_stop restrict the dump to a window, in ns. Each defaults to
+    its SIM_WAVES / SIM_WAVE_START / SIM_WAVE_STOP environment variable.
+    If wave_rerun is true and a test fails without waves, just that
+    test is run again with SIM_WAVE_ON_FAIL (default fst) waves,
+    starting SIM_WAVE_FAIL_WINDOW ns before the failure if set.
+
+    Every run writes a timing report, <work_dir>.timing.json, with the
+    wall time of each phase (setup, build or cache hit, compile steps,
+    simulator start-up, each test) and the simulated/real time ratio.
+    SIM_PROFILE selects profiling of the Python side (PROFILE_MODES).
+
+    build_profile (default: SIM_BUILD_PROFILE) selects the Verilator
+    build, one of BUILD_PROFILES or auto; the profile used is in the
+    timing report."""
+
+    start_time = time.perf_counter()
+    timings = {}
 
     # if json path is none, assume that it is the same as tbpath
     if(jsonpath is None):
@@ -40,48 +101,634 @@ def runner(simulator, timescale, tbpath, params, defs=[], testname=None, pymodul
     if(pymodule is None):
         pymodule = "test_" + top
 
-    if(testname is None):
-        testdir = "all"
-    else:
-        testdir=testname
-    
     # Assume all paths in the json file are relative to the repository root.
     if(root is None):
-        root = git.Repo(search_parent_directories=True).working_tree_dir
+        root = repo_root(tbpath)
+
+    assert (os.path.exists(root)), "root directory path must exist"
+
+    sources = get_sources(root, jsonpath, jsonname)
+
+    # Runs of another filelist's top (a sim-only wrapper) get their own
+    # work directories.
+    work_top = None if jsonname == "filelist.json" else top
+    work_dir = get_work_dir(tbpath, testname, params, simulator, work_top)
+    if(not os.path.exists(work_dir)):
+        os.makedirs(work_dir)
+
+    waves = get_wave_mode(waves)
+    if(wave_start is None):
+        wave_start = os.environ.get("SIM_WAVE_START")
+    if(wave_stop is None):
+        wave_stop = os.environ.get("SIM_WAVE_STOP")
+
+    build_profile, tuning = get_build_profile(simulator, top, params, build_profile)
+    compile_args, plus_args, defines = get_sim_args(simulator, defs, waves, build_profile, sources)
+    plus_args += get_wave_plus_args(simulator, timescale, waves, wave_start, wave_stop)
+    profile = get_profile_mode()
+
+    timings["setup"] = time.perf_counter() - start_time
+    report = {"simulator": simulator,
+              "top": top,
+              "module": pymodule,
+              "testcase": testname,
+              "params": params,
+              "waves": waves,
+              "profile": profile,
+              "build_profile": build_profile,
+              "phases": timings}
+    if(tuning is not None):
+        report["build_profile_tuning"] = tuning
+
+    if(not cache):
+        build_dir = os.path.join(tbpath, "build", get_param_string(params))
+        if(build_profile != "default"):
+            build_dir += "_" + build_profile
+
+        # Icarus doesn't build, it just runs.
+        if simulator.startswith("icarus"):
+            build_dir = work_dir
+
+        # Compile and run are one step here, so they are timed together,
+        # and the per-test timings are only known if the run passed.
+        # py-spy needs the cached path.
+        from cocotb_test.simulator import run
+
+        results_file = None
+        extra_env = {}
+        if(profile == "cprofile"):
+            extra_env["COCOTB_ENABLE_PROFILING"] = "1"
+        launch_time = time.perf_counter()
+        try:
+            results_file = run(**get_make_kwargs(simulator, build_profile),
+                verilog_sources=sources + get_wave_sources(build_dir, simulator, top, waves),
+                simulator=simulator,
+                toplevel=top,
+                module=pymodule,
+                compile_args=compile_args,
+                plus_args=plus_args,
+                sim_build=build_dir,
+                timescale=timescale,
+                parameters=params,
+                defines=defines,
+                extra_env=extra_env,
+                work_dir=work_dir,
+                waves=False,
+                testcase=testname)
+        finally:
+            timings["build_and_simulate"] = time.perf_counter() - launch_time
+            write_timing_report(work_dir, report, results_file, start_time)
+        return
+
+    # Compile phase: a no-op after the first test of a session that
+    # uses this (simulator, parameter set).
+    build_dir = build(simulator, timescale, tbpath, params, defs, pymodule, jsonpath, jsonname, root, waves, timings,
+                      build_profile)
+
+    sim = get_simulator(simulator)
+    sim = sim(prebuilt=True,
+              verilog_sources=sources + get_wave_sources(build_dir, simulator, top, waves),
+              toplevel=top,
+              module=pymodule,
+              compile_args=compile_args,
+              plus_args=plus_args,
+              sim_build=build_dir,
+              timescale=timescale,
+              parameters=params,
+              defines=defines,
+              work_dir=work_dir,
+              waves=False,
+              testcase=testname)
+    sim.profile = profile
+    if(profile == "cprofile"):
+        sim.env["COCOTB_ENABLE_PROFILING"] = "1"
+    try:
+        sim.run()
+    except SystemExit:
+        rerun = get_wave_mode(os.environ.get("SIM_WAVE_ON_FAIL", "fst"))
+        if(wave_rerun and waves == "none" and rerun != "none"):
+            window = os.environ.get("SIM_WAVE_FAIL_WINDOW")
+            for name, fail_ns in get_failed_tests(sim.env["COCOTB_RESULTS_FILE"]):
+                start = None
+                if(window is not None):
+                    start = max(0, fail_ns - float(window))
+                print(f"Re-running {name} with {rerun} waves (from {start or 0} ns)")
+                try:
+                    runner(simulator, timescale, tbpath, params, defs, name, pymodule, jsonpath, jsonname, root, cache,
+                           waves=rerun, wave_start=start, wave_rerun=False, build_profile=build_profile)
+                except SystemExit:
+                    pass
+                print("Waves: " + os.path.join(get_work_dir(tbpath, name, params, simulator, work_top), "dump." + rerun))
+        raise
+    finally:
+        timings.update(sim.phase_times)
+        write_timing_report(work_dir, report, sim.env.get("COCOTB_RESULTS_FILE"), start_time)
+
+    # Only passing runs count towards the auto-tuning.
+    if(tuning is not None):
+        record_profile_run(simulator, top, params, build_profile, report)
+
+# Models built by this process, keyed on their inputs, so that build()
+# only hashes the sources once per session.
+_session_builds = {}
+
+def build(simulator, timescale, tbpath, params, defs=[], pymodule=None, jsonpath=None, jsonname="filelist.json", root=None, waves="none",
+          timings=None, build_profile="default"):
+    """Compile (but do not run) the model for simulator with parameters
+    params and defines defs into the build cache, with the Verilator
+    build profile build_profile (see BUILD_PROFILES). Returns the build
+    directory. Each model is compiled at most once per session, and not
+    at all if the cache already holds it.
+
+    If timings is a dict, the wall time of the build (and of each
+    compile step, if it had to compile) is added to it."""
+    start_time = time.perf_counter()
+    if(timings is None):
+        timings = {}
+
+    # if json path is none, assume that it is the same as tbpath
+    if(jsonpath is None):
+        jsonpath = tbpath
+
+    assert (os.path.exists(jsonpath)), "jsonpath directory must exist"
+    top = get_top(jsonpath, jsonname)
+
+    if(pymodule is None):
+        pymodule = "test_" + top
+
+    if(root is None):
+        root = repo_root(tbpath)
 
     assert (os.path.exists(root)), "root directory path must exist"
 
-    sources = get_sources(root, tbpath)
+    sources = get_sources(root, jsonpath, jsonname)
+    compile_args, plus_args, defines = get_sim_args(simulator, defs, waves, build_profile, sources)
+    make_kwargs = get_make_kwargs(simulator, build_profile)
+
+    session_key = (simulator, top, tuple(sources), timescale, get_param_string(params), tuple(defines), waves, build_profile)
+    if(session_key in _session_builds):
+        timings["build"] = time.perf_counter() - start_time
+        timings["build_cached"] = "session"
+        return _session_builds[session_key]
 
-    work_dir = os.path.join(tbpath, "run", testdir, get_param_string(params), simulator)
-    build_dir = os.path.join(tbpath, "build", get_param_string(params))
+    # make -j (and ccache) don't change the model, so they are not part
+    # of the key; the profile's verilator arguments are in compile_args.
+    key = get_build_key(simulator, top, sources, timescale, params, defines, compile_args, waves)
+    build_dir = get_build_dir(top, simulator, key)
 
-    # Icarus doesn't build, it just runs.
-    if simulator.startswith("icarus"):
-        build_dir = work_dir
+    # Other pytest workers (xdist, util/regress.py) may want the same
+    # model; whoever holds the lock builds it, the rest reuse it.
+    timings["build_cached"] = "disk"
+    with build_lock(build_dir):
+        timings["build_lock_wait"] = time.perf_counter() - start_time
+        if(not is_cached_build(build_dir, key)):
+            timings["build_cached"] = "no"
+            if(simulator.startswith("verilator")):
+                timings["build_objcache"] = "ccache" if get_objcache_args(simulator) else "none"
+            sim = get_simulator(simulator)
+            sim = sim(compile_only=True,
+                **make_kwargs,
+                verilog_sources=sources + get_wave_sources(build_dir, simulator, top, waves),
+                toplevel=top,
+                module=pymodule,
+                compile_args=compile_args,
+                plus_args=plus_args,
+                sim_build=build_dir,
+                timescale=timescale,
+                parameters=params,
+                defines=defines,
+                waves=False)
+            try:
+                sim.run()
+            finally:
+                timings.update(sim.phase_times)
+            write_build_stamp(build_dir, key, simulator, top, sources, params)
 
+    _session_builds[session_key] = build_dir
+    timings["build"] = time.perf_counter() - start_time
+    return build_dir
+
+def get_sim_args(simulator, defs, waves="none", build_profile="default", sources=[]):
+    """ Get the compile arguments, plus arguments and defines used for
+    simulator.
+
+    Arguments:
+    simulator -- Name of the simulator
+    defs -- List of user defines
+    waves -- Wave mode, one of WAVE_MODES
+    build_profile -- Verilator build profile, one of BUILD_PROFILES
+    sources -- Resolved sources, to check whether they need --timing
+    """
     if simulator.startswith("verilator"):
-        compile_args=["-Wno-fatal", "-DVM_TRACE_FST=1", "-DVM_TRACE=1", "--timing"]
-        plus_args = ["--trace", "--trace-fst"]
-        if(not os.path.exists(work_dir)):
-            os.makedirs(work_dir)
+        bp = BUILD_PROFILES[build_profile]
+        compile_args=["-Wno-fatal"] + bp["args"]
+        timing = bp["timing"]
+        if(timing is None):
+            # The wave dump module waits for +dump_start with a delay.
+            timing = waves != "none" or needs_timing(sources)
+        if(timing):
+            compile_args += ["--timing"]
+        threads = bp["threads"] or get_threads()
+        if(threads > 1):
+            compile_args += ["--threads", str(threads)]
+        if(bp["split"]):
+            compile_args += ["--output-split", "20000", "--output-split-cfuncs", "20000"]
     else:
         compile_args=[]
-        plus_args = []
+    plus_args = []
+    defines = list(defs)
 
-    run(verilog_sources=sources,
-        simulator=simulator,
-        toplevel=top,
-        module=pymodule,
-        compile_args=compile_args,
-        plus_args=plus_args,
-        sim_build=build_dir,
-        timescale=timescale,
-        parameters=params,
-        defines=defs + ["VM_TRACE_FST=1", "VM_TRACE=1"],
-        work_dir=work_dir,
-        waves=True,
-        testcase=testname)
+    if waves == "none":
+        return compile_args, plus_args, defines
+
+    if simulator.startswith("verilator"):
+        trace = "--trace-fst" if waves == "fst" else "--trace"
+        compile_args += [trace, "--trace-structs"]
+    else:
+        compile_args += ["-s", "sim_dump"]
+
+    defines += ["VM_TRACE=1"]
+    if waves == "fst":
+        defines += ["VM_TRACE_FST=1"]
+    return compile_args, plus_args, defines
+
+# Delays and waits, which Verilator only simulates with --timing.
+# Parameter lists (#(...)) and always @(...) don't count. A miss is not
+# silent: Verilator stops with NEEDTIMINGOPT.
+_TIMING_RE = re.compile(r"#\s*[0-9]|\bwait\s*\(|\bforever\b")
+_COMMENT_RE = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+def needs_timing(sources):
+    """ Return True if any of sources has a delay or a wait statement.
+
+    Arguments:
+    sources -- List of source paths
+    """
+    for s in sources:
+        with open(s) as fd:
+            if(_TIMING_RE.search(_COMMENT_RE.sub("", fd.read()))):
+                return True
+    return False
+
+def get_threads():
+    """ Get the number of model threads for the max-throughput profile:
+    SIM_VERILATOR_THREADS, or up to 4 of the available CPUs. """
+    threads = os.environ.get("SIM_VERILATOR_THREADS")
+    if(threads):
+        return int(threads)
+    return max(1, min(4, len(os.sched_getaffinity(0))))
+
+def get_make_args(simulator, build_profile):
+    """ Get the make arguments of a build profile: -j for the profiles
+    that split their output. Empty for Icarus.
+
+    Arguments:
+    simulator -- Name of the simulator
+    build_profile -- Verilator build profile, one of BUILD_PROFILES
+    """
+    if(not simulator.startswith("verilator") or not BUILD_PROFILES[build_profile]["split"]):
+        return []
+    return ["-j", str(len(os.sched_getaffinity(0)))]
+
+def get_objcache_args(simulator):
+    """ Get the make arguments that compile a Verilator model through
+    ccache, with its cache in the build cache (see get_cache_root).
+
+    A Verilator model is one C++ program per top level: the provided/
+    cells are flattened into it, so there is no library of them to
+    link against. What every model does compile from the same sources
+    is the Verilator and cocotb runtime (verilated.cpp, verilated_vpi.cpp,
+    verilator.cpp, ...), which is most of a cold build of the small
+    designs here. With ccache those objects, and any generated C++ that
+    is the same as in another build, are compiled once and shared by
+    every module, parameter set and build profile.
+
+    Empty for Icarus, if ccache is not installed, or if SIM_CCACHE is 0.
+
+    Arguments:
+    simulator -- Name of the simulator
+    """
+    if(not simulator.startswith("verilator") or os.environ.get("SIM_CCACHE", "1") == "0"):
+        return []
+    if(shutil.which("ccache") is None):
+        return []
+    # Make passes command line variables on to ccache's environment.
+    # BASEDIR makes the paths inside each build directory relative, so
+    # that the same code in two builds hashes the same.
+    return ["OBJCACHE=ccache",
+            "CCACHE_DIR=" + os.path.join(get_cache_root(), "ccache"),
+            "CCACHE_BASEDIR=" + get_cache_root()]
+
+def get_make_kwargs(simulator, build_profile):
+    """ Get the extra cocotb-test arguments that set up the C++ compile
+    of a Verilator model: the profile's make arguments and ccache.
+    Empty for Icarus.
+
+    Arguments:
+    simulator -- Name of the simulator
+    build_profile -- Verilator build profile, one of BUILD_PROFILES
+    """
+    make_args = get_make_args(simulator, build_profile) + get_objcache_args(simulator)
+    if(not make_args):
+        return {}
+    return {"make_args": make_args}
+
+def get_build_profile(simulator, top, params, build_profile=None):
+    """ Resolve the build profile of a run. If build_profile is None it
+    is read from SIM_BUILD_PROFILE (default: default). Returns the
+    profile and, for auto, what it was chosen from (else None).
+
+    auto builds each of AUTO_PROFILES in turn until every one has a
+    passing run of the design (simulator, top and parameters), then
+    picks the one with the most simulated ns per second of simulator
+    wall time. The measurements are kept in profiles.json in the build
+    cache; delete it to tune again.
+
+    Arguments:
+    simulator -- Name of the simulator
+    top -- Name of the top level module
+    params -- Dictionary of top level parameters
+    build_profile -- One of BUILD_PROFILES, auto or None
+    """
+    if(build_profile is None):
+        build_profile = os.environ.get("SIM_BUILD_PROFILE") or "default"
+    assert build_profile in BUILD_PROFILES or build_profile == "auto", \
+        f"build profile must be one of {list(BUILD_PROFILES)} or auto, not {build_profile}"
+    if(not simulator.startswith("verilator")):
+        return "default", None
+    if(build_profile != "auto"):
+        return build_profile, None
+
+    runs = load_profile_runs().get(get_profile_key(simulator, top, params), {})
+    rates = {p: r["sim_ns"] / r["wall_s"] for p, r in runs.items() if p in AUTO_PROFILES and r["wall_s"] > 0}
+    untried = [p for p in AUTO_PROFILES if p not in rates]
+    if(untried):
+        chosen, reason = untried[0], "measuring"
+    else:
+        chosen, reason = max(AUTO_PROFILES, key=lambda p: rates[p]), "fastest"
+    print(f"Build profile: {chosen} (auto, {reason})")
+    return chosen, {"mode": "auto", "reason": reason, "sim_ns_per_s": rates}
+
+def get_profile_file():
+    """ Get the path of the auto-tuning measurements. """
+    return os.path.join(get_cache_root(), "profiles.json")
+
+def get_profile_key(simulator, top, params):
+    return "/".join([simulator, top, get_param_string(params)])
+
+def load_profile_runs():
+    """ Get the auto-tuning measurements: design key -> profile ->
+    total simulated ns and simulator wall seconds of its runs. """
+    path = get_profile_file()
+    if(not os.path.exists(path)):
+        return {}
+    with open(path) as fd:
+        return json.load(fd)
+
+def record_profile_run(simulator, top, params, build_profile, report):
+    """ Add a passing run to the auto-tuning measurements of its design.
+
+    Arguments:
+    simulator -- Name of the simulator
+    top -- Name of the top level module
+    params -- Dictionary of top level parameters
+    build_profile -- Profile the model was built with
+    report -- Timing report of the run (see write_timing_report)
+    """
+    wall = report["phases"].get("simulate")
+    if(not wall or not report["sim_ns"]):
+        return
+    path = get_profile_file()
+    # Other pytest workers may be recording runs too.
+    with build_lock(os.path.splitext(path)[0]):
+        runs = load_profile_runs()
+        entry = runs.setdefault(get_profile_key(simulator, top, params), {})
+        totals = entry.setdefault(build_profile, {"sim_ns": 0, "wall_s": 0, "runs": 0})
+        totals["sim_ns"] += report["sim_ns"]
+        totals["wall_s"] += wall
+        totals["runs"] += 1
+        with open(path + ".tmp", "w") as fd:
+            json.dump(runs, fd, indent=1)
+        os.replace(path + ".tmp", path)
+
+def get_wave_mode(waves=None):
+    """ Resolve the wave mode. If waves is None it is read from
+    SIM_WAVES, falling back to WAVES=1 for fst.
+
+    Arguments:
+    waves -- none, fst, vcd or None
+    """
+    if(waves is None):
+        waves = os.environ.get("SIM_WAVES")
+    if(waves is None):
+        waves = "fst" if os.environ.get("WAVES", "0") not in ("", "0") else "none"
+    assert waves in WAVE_MODES, f"waves must be one of {WAVE_MODES}, not {waves}"
+    return waves
+
+def get_profile_mode(profile=None):
+    """ Resolve the profiling mode. If profile is None it is read from
+    SIM_PROFILE.
+
+    Arguments:
+    profile -- none, cprofile, py-spy or None
+    """
+    if(profile is None):
+        profile = os.environ.get("SIM_PROFILE") or "none"
+    assert profile in PROFILE_MODES, f"profile must be one of {PROFILE_MODES}, not {profile}"
+    return profile
+
+def get_command_phase(cmd):
+    """ Name the phase a cocotb-test command belongs to, for the timing
+    report.
+
+    Arguments:
+    cmd -- Command as a list of arguments
+    """
+    tool = os.path.basename(cmd[0])
+    if(tool.startswith("verilator")):
+        return "verilate"
+    if(tool == "make"):
+        return "cxx_compile"
+    if(tool == "iverilog"):
+        return "compile"
+    return "simulate"
+
+def get_test_timings(results_file):
+    """ Get the wall time, simulated time and simulated/real ratio of
+    every test in a cocotb results file.
+
+    Arguments:
+    results_file -- Path to results.xml
+    """
+    tests = []
+    if(results_file is None or not os.path.exists(results_file)):
+        return tests
+    for case in ET.parse(results_file).getroot().iter("testcase"):
+        tests.append({"name": case.get("name"),
+                      "passed": case.find("failure") is None and case.find("error") is None,
+                      "wall_s": float(case.get("time", 0)),
+                      "sim_ns": float(case.get("sim_time_ns", 0)),
+                      "sim_ns_per_s": float(case.get("ratio_time", 0))})
+    return tests
+
+def write_timing_report(work_dir, report, results_file, start_time, top_n=25):
+    """ Complete a runner timing report and write it to
+    <work_dir>.timing.json. Prints a one line summary.
+
+    Arguments:
+    work_dir -- Work directory of the run
+    report -- Report dict; report["phases"] holds the phase timings
+    results_file -- cocotb results file, for the per-test timings
+    start_time -- time.perf_counter() at the start of the run
+    top_n -- Number of cProfile entries to keep
+    """
+    phases = report["phases"]
+    tests = get_test_timings(results_file)
+    report["tests"] = tests
+    report["total_s"] = time.perf_counter() - start_time
+
+    # Whatever the simulator spent outside the tests: loading the
+    # model, starting Python, elaboration and shutdown.
+    test_wall = sum(t["wall_s"] for t in tests)
+    if("simulate" in phases):
+        phases["sim_startup"] = max(0, phases["simulate"] - test_wall)
+    sim_ns = sum(t["sim_ns"] for t in tests)
+    report["sim_ns"] = sim_ns
+    report["sim_ns_per_s"] = sim_ns / test_wall if test_wall else None
+
+    profile_file = None
+    if(report["profile"] == "cprofile"):
+        profile_file = os.path.join(work_dir, "test_profile.pstat")
+    elif(report["profile"] == "py-spy"):
+        profile_file = os.path.join(work_dir, "py-spy.svg")
+    if(profile_file is not None and os.path.exists(profile_file)):
+        report["profile_file"] = profile_file
+        if(report["profile"] == "cprofile"):
+            stats = pstats.Stats(profile_file)
+            entries = sorted(stats.stats.items(), key=lambda e: e[1][3], reverse=True)[:top_n]
+            report["profile_top"] = [{"function": f"{f}:{l}({n})", "calls": nc, "tottime": tt, "cumtime": ct}
+                                     for (f, l, n), (cc, nc, tt, ct, callers) in entries]
+
+    path = work_dir.rstrip(os.sep) + ".timing.json"
+    with open(path, "w") as fd:
+        json.dump(report, fd, indent=1)
+
+    summary = " ".join(f"{k}={v:.2f}s" for k, v in phases.items() if isinstance(v, float))
+    rate = f", {report['sim_ns_per_s']:.0f} sim ns/s" if report["sim_ns_per_s"] else ""
+    print(f"Timing: {summary}, total={report['total_s']:.2f}s{rate} ({path})")
+    return path
+
+def get_wave_sources(build_dir, simulator, top, waves):
+    """ Write the wave dump control module for a build and return it as
+    a list of extra sources (empty if waves are off).
+
+    The module dumps to dump.fst or dump.vcd in the work directory. On
+    Icarus it is a second top level that owns the dump and honours
+    +dump_start and +dump_stop. On Verilator it is bound into the top
+    and opens the dump at +dump_start; without +dump_start the model's
+    own --trace flag is used instead. Verilator ignores $dumpoff, so a
+    window stop is only supported on Icarus.
+
+    Arguments:
+    build_dir -- Build directory of the model
+    simulator -- Name of the simulator
+    top -- Name of the top level module
+    waves -- Wave mode, one of WAVE_MODES
+    """
+    if waves == "none":
+        return []
+
+    dumpfile = "dump." + waves
+    if simulator.startswith("verilator"):
+        src = ("module sim_dump();\n"
+               "   reg [63:0] start_t;\n"
+               "   initial begin\n"
+               "      if ($value$plusargs(\"dump_start=%d\", start_t)) begin\n"
+               "         #(start_t);\n"
+               f"         $dumpfile(\"{dumpfile}\");\n"
+               "         $dumpvars;\n"
+               "      end\n"
+               "   end\n"
+               "endmodule\n"
+               f"bind {top} sim_dump u_sim_dump();\n")
+    else:
+        src = ("module sim_dump();\n"
+               "   reg [63:0] start_t, stop_t;\n"
+               "   initial begin\n"
+               f"      $dumpfile(\"{dumpfile}\");\n"
+               f"      $dumpvars(0, {top});\n"
+               "      if ($value$plusargs(\"dump_start=%d\", start_t)) begin\n"
+               "         $dumpoff;\n"
+               "         #(start_t) $dumpon;\n"
+               "      end\n"
+               "   end\n"
+               "   initial begin\n"
+               "      if ($value$plusargs(\"dump_stop=%d\", stop_t))\n"
+               "         #(stop_t) $dumpoff;\n"
+               "   end\n"
+               "endmodule\n")
+
+    os.makedirs(build_dir, exist_ok=True)
+    path = os.path.join(build_dir, "sim_dump.v")
+    if(not os.path.exists(path) or open(path).read() != src):
+        with open(path, "w") as fd:
+            fd.write(src)
+    return [path]
+
+def get_wave_plus_args(simulator, timescale, waves, start=None, stop=None):
+    """ Get the run time arguments that turn on wave dumping.
+
+    Arguments:
+    simulator -- Name of the simulator
+    timescale -- Timescale string, e.g. 1ps/1ps
+    waves -- Wave mode, one of WAVE_MODES
+    start -- Start of the dump window in ns, or None
+    stop -- End of the dump window in ns, or None (Icarus only)
+    """
+    if waves == "none":
+        return []
+
+    plus_args = []
+    if(start is not None):
+        plus_args.append("+dump_start={}".format(ns_to_steps(start, timescale)))
+    if(stop is not None):
+        assert simulator.startswith("icarus"), "wave_stop is only supported on Icarus"
+        plus_args.append("+dump_stop={}".format(ns_to_steps(stop, timescale)))
+
+    if simulator.startswith("verilator"):
+        if(start is None):
+            plus_args.append("--trace")
+    elif waves == "fst":
+        plus_args.append("-fst")
+    return plus_args
+
+def ns_to_steps(ns, timescale):
+    """ Convert a time in ns into time units of timescale.
+
+    Arguments:
+    ns -- Time in ns
+    timescale -- Timescale string, e.g. 1ps/1ps
+    """
+    unit = timescale.split("/")[0]
+    scale = {"s": 1e9, "ms": 1e6, "us": 1e3, "ns": 1, "ps": 1e-3, "fs": 1e-6}
+    number = int(unit.rstrip("munpfs"))
+    return int(round(float(ns) / (number * scale[unit.lstrip("0123456789")])))
+
+def get_failed_tests(results_file):
+    """ Get the failed tests in a cocotb results file as a list of
+    (name, simulation time of the failure in ns).
+
+    Arguments:
+    results_file -- Path to the cocotb results.xml
+    """
+    if(not os.path.exists(results_file)):
+        return []
+
+    failed = []
+    for tc in ET.parse(results_file).iter("testcase"):
+        if tc.find("failure") is not None or tc.find("error") is not None:
+            failed.append((tc.get("name"), float(tc.get("sim_time_ns", 0))))
+    return failed
 
 # Function to build (run) the lint and style checks.
 def lint(simulator, timescale, tbpath, params, defs=[], compile_args=[], pymodule=None, jsonpath=None, jsonname="filelist.json", root=None):
@@ -96,10 +743,10 @@ def lint(simulator, timescale, tbpath, params, defs=[], compile_args=[], pymodul
 
     # Assume all paths in the json file are relative to the repository root.
     if(root is None):
-        root = git.Repo(search_parent_directories=True).working_tree_dir
+        root = repo_root(tbpath)
 
     assert (os.path.exists(root)), "root directory path must exist"
-    sources = get_sources(root, tbpath)
+    sources = get_sources(root, jsonpath, jsonname)
 
     # if pymodule is none, assume that the python module name is test+<name of the top module>.
     if(pymodule is None):
@@ -115,7 +762,8 @@ def lint(simulator, timescale, tbpath, params, defs=[], compile_args=[], pymodul
 
     make_args = ["-n"]
     compile_args += ["--lint-only"]
- 
+
+    from cocotb_test.simulator import run
     run(verilog_sources=sources,
         simulator=simulator,
         toplevel=top,
@@ -130,27 +778,24 @@ def lint(simulator, timescale, tbpath, params, defs=[], compile_args=[], pymodul
 
 
 def get_files_from_filelist(p, n):
-    """ Get a list of files from a json filelist.
+    """ Get a list of files from a json filelist, including the files
+    of the filelists it includes (see util/filelist.py).
 
     Arguments:
     p -- Path to the directory that contains the .json file
     n -- name of the .json file to read.
     """
-    n = os.path.join(p, n)
-    with open(n) as filelist:
-        files = json.load(filelist)["files"]
-    return files
+    return list(resolve(p, n).files)
 
-def get_sources(r, p):
+def get_sources(r, p, n="filelist.json"):
     """ Get a list of source file paths from a json filelist.
 
     Arguments:
     r -- Absolute path to the root of the repository.
     p -- Absolute path to the directory containing filelist.json
+    n -- Name of the json filelist, defaults to filelist.json
     """
-    sources = get_files_from_filelist(p, "filelist.json")
-    sources = [os.path.join(r, f) for f in sources]
-    return sources
+    return [os.path.join(r, f) for f in resolve(p, n, r).files]
 
 def get_top(p, n="filelist.json"):
     """ Get the name of the top level module from a filelist.json.
@@ -159,7 +804,7 @@ def get_top(p, n="filelist.json"):
     p -- Absolute path to the directory containing json filelist
     n -- Name of the json filelist, defaults to filelist.json
     """
-    return get_top_from_filelist(p, "filelist.json")
+    return get_top_from_filelist(p, n)
 
 def get_top_from_filelist(p, n):
     """ Get the name of the top level module a json filelist.
@@ -168,10 +813,208 @@ def get_top_from_filelist(p, n):
     p -- Absolute path to the directory containing filelist.json
     n -- name of the .json file to read.
     """
-    n = os.path.join(p, n)
-    with open(n) as filelist:
-        top = json.load(filelist)["top"]
-        return top
+    return resolve(p, n).top
+
+# Simulator mixin that can launch an already-built model. When
+# prebuilt is true the compile steps are dropped and only the
+# simulation command is run. Every command is timed into phase_times
+# (see get_command_phase), and with profile == "py-spy" the
+# simulation runs under py-spy.
+class _PrebuiltSimulator:
+    def __init__(self, prebuilt=False, *argv, **kwargs):
+        super().__init__(*argv, **kwargs)
+        self.prebuilt = prebuilt
+        self.profile = "none"
+        self.phase_times = {}
+
+        # Icarus extends these in place; keep the caller's lists intact.
+        self.compile_args = list(self.compile_args)
+        self.plus_args = list(self.plus_args)
+
+    def execute(self, cmds):
+        for cmd in cmds:
+            phase = get_command_phase(cmd)
+            if(phase == "simulate" and self.profile == "py-spy"):
+                assert shutil.which("py-spy"), "SIM_PROFILE=py-spy needs py-spy on the PATH"
+                cmd = ["py-spy", "record", "--subprocesses", "-o", os.path.join(self.work_dir, "py-spy.svg"), "--"] + cmd
+            start_time = time.perf_counter()
+            try:
+                super().execute([cmd])
+            finally:
+                self.phase_times[phase] = self.phase_times.get(phase, 0) + time.perf_counter() - start_time
+
+    def build_command(self):
+        cmds = super().build_command()
+        if(self.prebuilt):
+            # The simulation command is always the last one.
+            cmds = [] if self.compile_only else cmds[-1:]
+        return cmds
+
+@functools.lru_cache(maxsize=None)
+def get_simulator(simulator):
+    """ Get the cache-aware simulator class for simulator. cocotb_test
+    is only imported here (and by runner and lint), so the testbench
+    modules load without it inside the simulator.
+
+    Arguments:
+    simulator -- Name of the simulator, verilator or icarus
+    """
+    from cocotb_test.simulator import Verilator, Icarus
+
+    if simulator.startswith("verilator"):
+        return type("CachedVerilator", (_PrebuiltSimulator, Verilator), {})
+    assert simulator.startswith("icarus"), f"Unsupported simulator: {simulator}"
+    return type("CachedIcarus", (_PrebuiltSimulator, Icarus), {})
+
+def get_cache_root():
+    """ Get the root directory of the persistent simulator build cache.
+
+    The cache lives outside of the module directories so that it
+    survives "make clean". Set SIM_BUILD_CACHE to move it.
+    """
+    root = os.environ.get("SIM_BUILD_CACHE")
+    if(root is None):
+        xdg = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        root = os.path.join(xdg, "cocotb-soc", "build")
+    return root
+
+@functools.lru_cache(maxsize=None)
+def get_sim_version(simulator):
+    """ Get the version string of a simulator (first line of its
+    version output), or "unknown" if it cannot be run.
+
+    Arguments:
+    simulator -- Name of the simulator, e.g. verilator or icarus
+    """
+    if simulator.startswith("verilator"):
+        cmd = ["verilator", "--version"]
+    elif simulator.startswith("icarus"):
+        cmd = ["iverilog", "-V"]
+    else:
+        return simulator
+
+    if(shutil.which(cmd[0]) is None):
+        return "unknown"
+
+    out = subprocess.run(cmd, capture_output=True, text=True).stdout
+    return out.splitlines()[0].strip() if out else "unknown"
+
+def hash_file(path):
+    """ Get the sha256 hex digest of the contents of a file.
+
+    Arguments:
+    path -- Path to the file
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def get_build_key(simulator, top, sources, timescale, params, defines, compile_args, waves):
+    """ Get the build cache key for a simulator model: a sha256 over
+    everything that affects the compiled output.
+
+    Arguments:
+    simulator -- Name of the simulator
+    top -- Name of the top level module
+    sources -- List of resolved source paths (see get_sources)
+    timescale -- Timescale string, e.g. 1ps/1ps
+    params -- Dictionary of top level parameters
+    defines -- List of preprocessor defines
+    compile_args -- List of extra compiler arguments
+    waves -- True if the model is built with wave dumping
+    """
+    h = hashlib.sha256()
+
+    def update(name, value):
+        h.update("{}={}\n".format(name, value).encode())
+
+    update("simulator", simulator)
+    update("version", get_sim_version(simulator))
+    update("cocotb", cocotb.__version__)
+    update("top", top)
+    for s in sources:
+        update("source", s)
+        update("hash", hash_file(s))
+    update("timescale", timescale)
+    update("params", get_param_string(dict(sorted(params.items()))))
+    update("defines", " ".join(defines))
+    update("compile_args", " ".join(compile_args))
+    update("waves", bool(waves))
+    return h.hexdigest()
+
+def get_build_dir(top, simulator, key):
+    """ Get the build cache directory for a model.
+
+    Arguments:
+    top -- Name of the top level module
+    simulator -- Name of the simulator
+    key -- Build key from get_build_key
+    """
+    return os.path.join(get_cache_root(), top, simulator, key[:16])
+
+@contextlib.contextmanager
+def build_lock(build_dir):
+    """ Hold an exclusive, inter-process lock on build_dir.
+
+    Arguments:
+    build_dir -- Build cache directory from get_build_dir
+    """
+    os.makedirs(os.path.dirname(build_dir), exist_ok=True)
+    with open(build_dir + ".lock", "w") as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+def is_cached_build(build_dir, key):
+    """ Return True if build_dir holds a complete build for key.
+
+    Arguments:
+    build_dir -- Build cache directory from get_build_dir
+    key -- Build key from get_build_key
+    """
+    stamp = os.path.join(build_dir, "build.json")
+    if(not os.path.exists(stamp)):
+        return False
+    with open(stamp) as fd:
+        return json.load(fd).get("key") == key
+
+def write_build_stamp(build_dir, key, simulator, top, sources, params):
+    """ Mark build_dir as a complete build for key. The stamp is only
+    written after a successful compile, so an interrupted build is
+    never reused.
+    """
+    stamp = {"key": key,
+             "simulator": simulator,
+             "version": get_sim_version(simulator),
+             "top": top,
+             "sources": sources,
+             "params": params}
+    with open(os.path.join(build_dir, "build.json"), "w") as fd:
+        json.dump(stamp, fd, indent=2)
+
+def get_work_dir(tbpath, testname, params, simulator, top=None):
+    """ Get the work directory of a run: run/<test or all>/<params>/<sim>
+    under tbpath, plus seed<N> if the run has a fixed RANDOM_SEED (so
+    that runs of several seeds, e.g. from util/regress.py --seeds, do
+    not share one).
+
+    Arguments:
+    tbpath -- Module directory
+    testname -- Test name, or None for all tests
+    params -- Parameter dict
+    simulator -- Name of the simulator
+    top -- Top level, if the run is not of the module's own (e.g. a
+           sim-only wrapper); it gets a directory of its own
+    """
+    work_dir = os.path.join(tbpath, "run", testname or "all", top or "", get_param_string(params), simulator)
+    seed = os.environ.get("RANDOM_SEED")
+    if(seed):
+        work_dir = os.path.join(work_dir, "seed" + seed)
+    return work_dir
 
 def get_param_string(parameters):
     """ Get a string of all the parameters concatenated together.
@@ -182,6 +1025,17 @@ def get_param_string(parameters):
     return "_".join(("{}={}".format(*i) for i in parameters.items()))
 
 
+def get_uart_speed():
+    """ Get the UART speed mode for simulation from SIM_UART_SPEED
+    (or --uart-speed): "fast" (the default) runs the UARTs with a
+    sim-only baud override, "real" keeps the hardware baud rate for
+    time-accurate runs. It is read both when choosing the parameters
+    and inside the simulator, so the drivers always match the DUT.
+    """
+    speed = os.environ.get("SIM_UART_SPEED", "fast")
+    assert speed in ("fast", "real"), f"SIM_UART_SPEED must be fast or real, not {speed}"
+    return speed
+
 def assert_resolvable(s):
     assert s.value.is_resolvable, f"Unresolvable value in {s._path} (x or z in some or all bits) at Time {get_sim_time(units='ns')}ns."
 
@@ -222,5 +1076,39 @@ async def delay_cycles(dut, ncyc, polarity):
         else:
             await FallingEdge(dut.clk_i)
 
+async def wait_value(s, value=None, timeout=1, unit='ms'):
+    """Wait until signal s equals value, or until it changes if value is
+    None. Raises cocotb.result.SimTimeoutError after timeout."""
+    async def wait():
+        if value is None:
+            await Edge(s)
+            return
+        while not (s.value.is_resolvable and int(s.value) == value):
+            await Edge(s)
+
+    await with_timeout(wait(), timeout, unit)
+    return int(s.value)
+
+async def read_uart_bytes(snk, count):
+    """Read exactly count bytes from a UartSink, waiting for as many as
+    it takes. UartSink.read(count) only waits for the first byte (and
+    then fails if fewer than count have arrived), so this reads what
+    is there, up to count, until it has them all. Bytes after the
+    count stay in the sink.
+
+    Arguments:
+    snk -- cocotbext.uart UartSink
+    count -- Number of bytes
+    """
+    buf = bytearray()
+    while len(buf) < count:
+        buf += await snk.read(min(count - len(buf), max(snk.count(), 1)))
+    return buf
+
+async def wait_uart_bytes(snk, count, timeout=1, unit='ms'):
+    """Wait until a UartSink has received count bytes and return them.
+    Raises cocotb.result.SimTimeoutError after timeout."""
+    return await with_timeout(read_uart_bytes(snk, count), timeout, unit)
+
 def assert_passerror(s):
     assert s.value.is_resolvable, f"Testbench pass/fail output ({s._path}) is set to x or z, but must be explicitly set to 0 at start of simulation.."